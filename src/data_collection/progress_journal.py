@@ -0,0 +1,119 @@
+import os
+import csv
+import json
+
+TAIL_CHUNK_BYTES = 64 * 1024
+
+class ProgressJournal:
+    """ Collected tracks by ISRC: an append-only JSON-lines journal, compacted into the output CSV.
+
+    record() appends one line, so a write costs the same however much has
+    been collected, and a crash loses at most the line being written.
+    compact() moves the journal's rows to the end of the CSV and empties the
+    journal; it runs every compact_every records and on close. A CSV row
+    cut short by a crash is dropped before the CSV is read or appended to;
+    its record is still in the journal. A track is done once its ISRC is in
+    either file, and checking that is a set lookup.
+    """
+
+    def __init__(self, output_file, output_columns, compact_every=1000):
+        self.output_file = output_file
+        self.output_columns = output_columns
+        self.compact_every = compact_every
+        self.journal_file = os.path.splitext(output_file)[0] + '.journal.jsonl'
+        self._drop_torn_row()
+        self.compacted = self._read_compacted()
+        self.pending = self._read_journal()
+        self._journal = open(self.journal_file, 'a', encoding='utf-8')
+        if self._journal.tell() and not self._ends_with_newline():
+            self._journal.write('\n')  # Don't glue the next record onto a line cut short by a crash
+        print(f"Loaded progress for {len(self)} tracks.")
+
+    def __contains__(self, isrc):
+        return isrc in self.compacted or isrc in self.pending
+
+    def __len__(self):
+        return len(self.compacted) + len(self.pending.keys() - self.compacted)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def record(self, row):
+        self._journal.write(json.dumps(row) + '\n')
+        self._journal.flush()
+        self.pending[row['isrc']] = row
+        if len(self.pending) >= self.compact_every:
+            self.compact()
+
+    def compact(self):
+        """ Append the journal's rows to the output CSV, then empty the journal. """
+        rows = [row for isrc, row in self.pending.items() if isrc not in self.compacted]
+        if rows:
+            self._drop_torn_row()
+            write_header = not os.path.exists(self.output_file) or os.path.getsize(self.output_file) == 0
+            with open(self.output_file, mode='a', encoding='utf-8', newline='') as outfile:
+                writer = csv.DictWriter(outfile, fieldnames=self.output_columns)
+                if write_header:
+                    writer.writeheader()
+                for row in rows:
+                    writer.writerow({field: row.get(field, '') for field in self.output_columns})
+                outfile.flush()
+                os.fsync(outfile.fileno())
+            self.compacted.update(row['isrc'] for row in rows)
+        # Rows already in the CSV are skipped above, so a crash before this truncation is harmless
+        self._journal.truncate(0)
+        self.pending = {}
+
+    def close(self):
+        self.compact()
+        self._journal.close()
+
+    def _drop_torn_row(self):
+        """ Cut the output CSV back to the end of its last complete line. """
+        try:
+            with open(self.output_file, 'rb+') as outfile:
+                end = outfile.seek(0, os.SEEK_END)
+                position = end
+                while position > 0:
+                    start = max(0, position - TAIL_CHUNK_BYTES)
+                    outfile.seek(start)
+                    newline = outfile.read(position - start).rfind(b'\n')
+                    if newline >= 0:
+                        position = start + newline + 1
+                        break
+                    position = start
+                if position < end:
+                    print(f"Dropping a row of {self.output_file} cut short by a crash; it is rewritten from the journal.")
+                    outfile.truncate(position)
+        except FileNotFoundError:
+            pass
+
+    def _ends_with_newline(self):
+        with open(self.journal_file, 'rb') as journal:
+            journal.seek(-1, os.SEEK_END)
+            return journal.read(1) == b'\n'
+
+    def _read_compacted(self):
+        try:
+            with open(self.output_file, 'r', encoding='utf-8') as infile:
+                return {row['isrc'] for row in csv.DictReader(infile)}
+        except FileNotFoundError:
+            print("No existing progress file found. Starting fresh.")
+            return set()
+
+    def _read_journal(self):
+        pending = {}
+        try:
+            with open(self.journal_file, 'r', encoding='utf-8') as journal:
+                for line in journal:
+                    try:
+                        row = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue  # A line cut short by a crash
+                    pending[row['isrc']] = row
+        except FileNotFoundError:
+            pass
+        return pending
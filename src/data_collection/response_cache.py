@@ -0,0 +1,83 @@
+import os
+import json
+import time
+import sqlite3
+import threading
+
+DEFAULT_TTL_SECONDS = 30 * 24 * 3600
+# Outside the repository, so neither the cache nor the token can be committed by accident
+CACHE_DIRECTORY = os.path.join(os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache'), 'coloring-emotions-in-music')
+DEFAULT_CACHE_FILE = os.path.join(CACHE_DIRECTORY, 'audio_features_cache.sqlite')
+DEFAULT_TOKEN_FILE = os.path.join(CACHE_DIRECTORY, 'spotify_token.json')
+
+class ResponseCache:
+    """ Spotify responses by track ID in a SQLite file, so re-runs do not fetch what was already seen.
+
+    Entries older than ttl seconds count as missing. A None response, for
+    a track Spotify has no features for, is cached like any other so it
+    is not asked for again until it expires. Safe to share between threads.
+    """
+
+    def __init__(self, path, ttl=DEFAULT_TTL_SECONDS):
+        self.path = path
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        make_parent_directory(path)
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('CREATE TABLE IF NOT EXISTS responses (track_id TEXT PRIMARY KEY, body TEXT, fetched_at REAL)')
+        self.connection.commit()
+
+    def get_many(self, track_ids):
+        """ {track_id: response} for the IDs with a fresh entry. """
+        cached = {}
+        with self.lock:
+            for start in range(0, len(track_ids), 500):
+                chunk = track_ids[start:start + 500]
+                rows = self.connection.execute(
+                    f"SELECT track_id, body FROM responses WHERE fetched_at >= ? AND track_id IN ({','.join('?' * len(chunk))})",
+                    [time.time() - self.ttl, *chunk])
+                cached.update((track_id, json.loads(body)) for track_id, body in rows)
+        return cached
+
+    def put_many(self, responses):
+        now = time.time()
+        with self.lock:
+            self.connection.executemany('INSERT OR REPLACE INTO responses VALUES (?, ?, ?)',
+                                        [(track_id, json.dumps(body), now) for track_id, body in responses.items()])
+            self.connection.commit()
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+class TokenFile:
+    """ An access token and its expiry, persisted so later runs reuse it instead of requesting a new one. """
+
+    def __init__(self, path):
+        self.path = path
+
+    def load(self):
+        """ (access_token, expires_at), or (None, 0) if there is no readable token file. """
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                token = json.load(f)
+            return token['access_token'], float(token['expires_at'])
+        except (FileNotFoundError, ValueError, KeyError):
+            return None, 0.0
+
+    def save(self, access_token, expires_at):
+        # Written whole under a temporary name and readable only by the owner
+        make_parent_directory(self.path)
+        temporary = f'{self.path}.tmp'
+        descriptor = os.open(temporary, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        # A temporary file left behind by an older run keeps its mode through O_CREAT
+        os.fchmod(descriptor, 0o600)
+        with os.fdopen(descriptor, 'w', encoding='utf-8') as f:
+            json.dump({'access_token': access_token, 'expires_at': expires_at}, f)
+        os.replace(temporary, self.path)
+
+def make_parent_directory(path):
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, mode=0o700, exist_ok=True)
@@ -1,41 +1,191 @@
+import time
 import base64
+import random
+import threading
 import requests
+from requests.adapters import HTTPAdapter
+
+API_URL = 'https://api.spotify.com/v1'
+TOKEN_URL = 'https://accounts.spotify.com/api/token'
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+AUDIO_FEATURES_BATCH_SIZE = 100  # The most IDs the several-tracks endpoint accepts
+
+class TokenBucket:
+    """ Thread-safe token bucket: on average rate acquisitions per second, in bursts of up to capacity. """
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """ Block until a token is available and take it. """
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if now >= self.paused_until and self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = max(self.paused_until - now, (1 - self.tokens) / self.rate)
+            time.sleep(wait)
+
+    def pause(self, seconds):
+        """ Hand out no tokens for seconds, e.g. after the server asked us to back off, and drop any saved-up burst. """
+        with self.lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+            self.tokens = 0.0
 
 class SpotifyClient:
-    def __init__(self, client_id, client_secret):
+    """ Spotify Web API client that can be shared by several threads.
+
+    Requests go through one keep-alive Session and a token bucket of
+    requests_per_second. A 429 pauses the bucket for the Retry-After the
+    server sent, so every thread backs off, and 429s, 5xx responses and
+    connection errors are retried up to max_retries times with jittered
+    exponential backoff. api_url and token_url can point at a local stub
+    server.
+
+    With a ResponseCache, audio features already fetched are answered from
+    disk. With a TokenFile, the access token is reused across runs. It is
+    renewed refresh_margin seconds before it expires, and when the API
+    rejects it.
+    """
+
+    def __init__(self, client_id, client_secret, requests_per_second=10.0, max_retries=5, backoff=1.0, pool_size=16,
+                 api_url=API_URL, token_url=TOKEN_URL, timeout=30, cache=None, token_file=None, refresh_margin=60):
         self.client_id = client_id
         self.client_secret = client_secret
-        self.access_token = None
+        self.cache = cache
+        self.token_file = token_file
+        self.refresh_margin = refresh_margin
+        self.access_token, self.expires_at = token_file.load() if token_file is not None else (None, 0.0)
+        self.api_url = api_url.rstrip('/')
+        self.token_url = token_url
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.rate_limiter = TokenBucket(requests_per_second)
+        self.token_lock = threading.Lock()
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=2, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
 
     def get_access_token(self):
         """ Get Spotify access token """
         client_creds = f"{self.client_id}:{self.client_secret}"
         client_creds_b64 = base64.b64encode(client_creds.encode()).decode()
-        token_url = 'https://accounts.spotify.com/api/token'
         token_data = {"grant_type": "client_credentials"}
         token_headers = {"Authorization": f"Basic {client_creds_b64}"}
 
         try:
-            response = requests.post(token_url, data=token_data, headers=token_headers)
+            response = self.request('POST', self.token_url, data=token_data, headers=token_headers)
             response.raise_for_status()
             token_response_data = response.json()
             self.access_token = token_response_data['access_token']
+            self.expires_at = time.time() + token_response_data.get('expires_in', 3600)
+            if self.token_file is not None:
+                self.token_file.save(self.access_token, self.expires_at)
         except requests.exceptions.RequestException as e:
             print(f"Error getting access token: {e}")
             raise
 
+    def ensure_access_token(self, rejected=None):
+        """ The current access token, first renewing it if it is about to expire or is the rejected one. """
+        with self.token_lock:
+            if self.access_token is None or self.access_token == rejected or time.time() >= self.expires_at - self.refresh_margin:
+                self.get_access_token()
+            return self.access_token
+
+    def api_get(self, endpoint, **kwargs):
+        """ An authorized GET, retried once with a new token if the API rejects the current one. """
+        access_token = self.ensure_access_token()
+        response = self.request('GET', endpoint, headers={"Authorization": f"Bearer {access_token}"}, **kwargs)
+        if response.status_code == 401:
+            access_token = self.ensure_access_token(rejected=access_token)
+            response = self.request('GET', endpoint, headers={"Authorization": f"Bearer {access_token}"}, **kwargs)
+        return response
+
+    def request(self, method, url, **kwargs):
+        """ Send a rate-limited request, retrying throttled and transient failures; returns the last response. """
+        for attempt in range(self.max_retries + 1):
+            self.rate_limiter.acquire()
+            try:
+                response = self.session.request(method, url, timeout=self.timeout, **kwargs)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+                if attempt == self.max_retries:
+                    raise
+                time.sleep(self.backoff_delay(attempt))
+                continue
+
+            if response.status_code not in RETRY_STATUSES or attempt == self.max_retries:
+                return response
+            if response.status_code == 429:
+                self.rate_limiter.pause(retry_after(response, self.backoff_delay(attempt)))
+            else:
+                time.sleep(self.backoff_delay(attempt))
+        return response
+
+    def backoff_delay(self, attempt):
+        return self.backoff * 2 ** attempt * random.uniform(0.5, 1.5)
+
     def get_audio_features(self, track_id):
         """ Get audio features for a track by its Spotify ID """
-        if self.access_token is None:
-            self.get_access_token()
+        if self.cache is not None:
+            cached = self.cache.get_many([track_id])
+            if track_id in cached:
+                return cached[track_id]
 
-        headers = {"Authorization": f"Bearer {self.access_token}"}
-        endpoint = f'https://api.spotify.com/v1/audio-features/{track_id}'
+        endpoint = f'{self.api_url}/audio-features/{track_id}'
 
         try:
-            response = requests.get(endpoint, headers=headers)
+            response = self.api_get(endpoint)
             response.raise_for_status()
-            return response.json()
+            audio_features = response.json()
+            if self.cache is not None:
+                self.cache.put_many({track_id: audio_features})
+            return audio_features
         except requests.exceptions.RequestException as e:
             print(f"Error getting audio features: {e}")
-            return None
\ No newline at end of file
+            return None
+
+    def get_several_audio_features(self, track_ids):
+        """ Get audio features for up to AUDIO_FEATURES_BATCH_SIZE tracks in one request.
+
+        Returns one entry per ID, in order, None for IDs Spotify has no
+        features for. A failed request, or failing to get a token, raises
+        requests.exceptions.RequestException. Only the IDs missing from the
+        cache are requested, so nothing is sent when all of them are cached.
+        """
+        if len(track_ids) > AUDIO_FEATURES_BATCH_SIZE:
+            raise ValueError(f"At most {AUDIO_FEATURES_BATCH_SIZE} track IDs per request, got {len(track_ids)}")
+        found = self.cache.get_many(track_ids) if self.cache is not None else {}
+        missing = [track_id for track_id in track_ids if track_id not in found]
+        if not missing:
+            return [found[track_id] for track_id in track_ids]
+
+        endpoint = f'{self.api_url}/audio-features'
+
+        try:
+            response = self.api_get(endpoint, params={'ids': ','.join(missing)})
+            response.raise_for_status()
+            fetched = dict(zip(missing, response.json()['audio_features']))
+            if self.cache is not None:
+                self.cache.put_many(fetched)
+            found.update(fetched)
+            return [found[track_id] for track_id in track_ids]
+        except requests.exceptions.RequestException as e:
+            print(f"Error getting audio features: {e}")
+            raise
+
+def retry_after(response, default):
+    """ Seconds to wait from a response's Retry-After header, or default if it has none. """
+    try:
+        return max(0.0, float(response.headers['Retry-After']))
+    except (KeyError, ValueError):
+        return default
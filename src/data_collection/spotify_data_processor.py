@@ -1,63 +1,108 @@
 import csv
-from time import sleep
-import random
 import requests
 import os
-from spotify_client import SpotifyClient
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from progress_journal import ProgressJournal
+from spotify_client import SpotifyClient, API_URL, TOKEN_URL, AUDIO_FEATURES_BATCH_SIZE
+from response_cache import ResponseCache, TokenFile, DEFAULT_TTL_SECONDS, DEFAULT_CACHE_FILE, DEFAULT_TOKEN_FILE
 from dotenv import load_dotenv
 
+DEFAULT_WORKERS = 8
+DEFAULT_REQUESTS_PER_SECOND = 10.0
+
 def extract_track_id(spotify_uri):
     return spotify_uri.split(":")[-1]
 
-def load_progress_from_csv(output_file):
-    progress_dict = {}
-    try:
-        with open(output_file, 'r', encoding='utf-8') as infile:
-            reader = csv.DictReader(infile)
-            for row in reader:
-                progress_dict[row['isrc']] = row
-        print(f"Loaded progress for {len(progress_dict)} tracks.")
-    except FileNotFoundError:
-        print("No existing progress file found. Starting fresh.")
-    return progress_dict
-
-def save_progress(output_file, output_columns, progress_dict):
-    with open(output_file, mode='w', encoding='utf-8', newline='') as outfile:
-        writer = csv.DictWriter(outfile, fieldnames=output_columns)
-        writer.writeheader()
-        for features in progress_dict.values():
-            writer.writerow({field: features.get(field, '') for field in output_columns})
-
-def process_tracks(client_id, client_secret, input_file, output_file, output_columns):
-    spotify_client = SpotifyClient(client_id, client_secret)
-    progress_dict = load_progress_from_csv(output_file)
-    
+def pending_rows(input_file, journal):
     with open(input_file, 'r', encoding='utf-8') as infile:
         reader = csv.DictReader(infile)
         for row in reader:
-            track_spotify_id = extract_track_id(row['spotify_uri'])
-            if row['isrc'] in progress_dict:
+            if row['isrc'] in journal:
                 continue
+            yield row
+
+def batched(rows, size):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def fetch_batch(spotify_client, batch):
+    """ Audio features for a batch of rows in one request; returns (row, features) pairs, features None when Spotify has none.
+
+    A failed request raises, which stops collect.
+    """
+    track_ids = list(dict.fromkeys(extract_track_id(row['spotify_uri']) for row in batch))
+    features = spotify_client.get_several_audio_features(track_ids)
+    by_id = dict(zip(track_ids, features))
+    return [(row, by_id[extract_track_id(row['spotify_uri'])]) for row in batch]
+
+def process_tracks(client_id, client_secret, input_file, output_file, output_columns, workers=DEFAULT_WORKERS,
+                   requests_per_second=DEFAULT_REQUESTS_PER_SECOND, api_url=API_URL, token_url=TOKEN_URL, batch_size=AUDIO_FEATURES_BATCH_SIZE,
+                   compact_every=1000, cache_file=None, cache_ttl=DEFAULT_TTL_SECONDS, token_file=None):
+    """ Fetch the audio features of every track not yet in output_file, workers at a time.
+
+    Pending tracks are fetched in batches of up to batch_size IDs per
+    request. The client's token bucket, not the number of workers, sets the
+    request rate. Rows are read lazily and at most twice as many requests
+    as there are workers are in flight, so memory does not grow with the
+    input. Results go to a ProgressJournal keyed by ISRC, compacted into
+    output_file every compact_every tracks and at the end.
+
+    Responses are kept in cache_file for cache_ttl seconds, so rebuilding
+    the output fetches only tracks not seen before; token_file keeps the
+    access token between runs.
+    """
+    cache = ResponseCache(cache_file, cache_ttl) if cache_file else None
+    spotify_client = SpotifyClient(client_id, client_secret, requests_per_second, pool_size=workers, api_url=api_url, token_url=token_url,
+                                   cache=cache, token_file=TokenFile(token_file) if token_file else None)
+    try:
+        collect(spotify_client, input_file, output_file, output_columns, workers, batch_size, compact_every)
+    finally:
+        if cache is not None:
+            cache.close()
+
+def collect(spotify_client, input_file, output_file, output_columns, workers, batch_size, compact_every):
+    with ProgressJournal(output_file, output_columns, compact_every) as journal, ThreadPoolExecutor(max_workers=workers) as executor:
+        batches = batched(pending_rows(input_file, journal), batch_size)
+        in_flight = set()
+        exhausted = False
+        while True:
+            while not exhausted and len(in_flight) < 2 * workers:
+                batch = next(batches, None)
+                if batch is None:
+                    exhausted = True
+                    break
+                in_flight.add(executor.submit(fetch_batch, spotify_client, batch))
+            if not in_flight:
+                break
+
+            done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
             try:
-                audio_features = spotify_client.get_audio_features(track_spotify_id)
-                if audio_features:
-                    progress_dict[track_spotify_id] = {
-                        'isrc': row['isrc'],
-                        'title': row['title'],
-                        'artist': row['artist'],
-                        'genre_id': row['genre_id'],
-                        'genre_name': row['genre_name'],
-                        'category_id': row['category_id'],
-                        'category_name': row['category_name'],
-                        **audio_features
-                    }
-                    print(f"Processed row: {row}.")
-                sleep(random.uniform(0.2, 1))  # To avoid hitting API rate limits
+                for row, audio_features in (pair for future in done for pair in future.result()):
+                    if audio_features:
+                        journal.record({
+                            'isrc': row['isrc'],
+                            'title': row['title'],
+                            'artist': row['artist'],
+                            'genre_id': row['genre_id'],
+                            'genre_name': row['genre_name'],
+                            'category_id': row['category_id'],
+                            'category_name': row['category_name'],
+                            **audio_features
+                        })
+                        print(f"Processed row: {row}.")
+                    else:
+                        print(f"No audio features for {row['isrc']}.")
             except requests.exceptions.RequestException as e:
-                print(f"Error processing {row['isrc']}: {e}")
-                break  # Break on error to save progress immediately
-
-            save_progress(output_file, output_columns, progress_dict)
+                print(f"Error processing tracks: {e}")
+                for future in in_flight:
+                    future.cancel()
+                break  # Stop on error; what has been fetched so far is in the journal
 
 if __name__ == '__main__':
     load_dotenv("auth.env")
@@ -74,4 +119,11 @@ if __name__ == '__main__':
                       'danceability', 'energy', 'key', 'loudness', 'mode', 'speechiness', 'acousticness',
                       'instrumentalness', 'liveness', 'valence', 'tempo', 'duration_ms', 'time_signature']
 
-    process_tracks(client_id, client_secret, input_file, output_file, output_columns)
\ No newline at end of file
+    # The URLs can point at a local stub server to try a run offline
+    process_tracks(client_id, client_secret, input_file, output_file, output_columns,
+                   workers=int(os.getenv('SPOTIFY_WORKERS', DEFAULT_WORKERS)),
+                   requests_per_second=float(os.getenv('SPOTIFY_REQUESTS_PER_SECOND', DEFAULT_REQUESTS_PER_SECOND)),
+                   api_url=os.getenv('SPOTIFY_API_URL', API_URL), token_url=os.getenv('SPOTIFY_TOKEN_URL', TOKEN_URL),
+                   cache_file=os.getenv('SPOTIFY_CACHE', DEFAULT_CACHE_FILE),
+                   cache_ttl=float(os.getenv('SPOTIFY_CACHE_TTL_SECONDS', DEFAULT_TTL_SECONDS)),
+                   token_file=os.getenv('SPOTIFY_TOKEN_FILE', DEFAULT_TOKEN_FILE))
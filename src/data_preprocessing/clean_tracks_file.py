@@ -1,19 +1,22 @@
 import csv
 import os
 
-def get_genres_and_categories(tracks_file, output_file):
-    unique_genres_categories = set()
+TRACK_FIELDS = ['isrc', 'title', 'spotify_uri', 'artist', 'genre_id', 'genre_name', 'category_id', 'category_name']
 
-    with open(tracks_file, 'r', newline='', encoding='utf-8') as csvfile:
-        reader = csv.DictReader(csvfile)
-        for row in reader:
-            genre_id = row['genre_id']
-            genre_name = row['genre_name']
-            category_id = row['category_id']
-            category_name = row['category_name']
-            unique_genres_categories.add((genre_id, genre_name, category_id, category_name))
+def genre_category(row):
+    return (row['genre_id'], row['genre_name'], row['category_id'], row['category_name'])
 
-    sorted_genres_categories = sorted(unique_genres_categories, key=lambda x: x[3])
+def load_genres_to_exclude(genres_to_exclude_file):
+    with open(genres_to_exclude_file, 'r', newline='', encoding='utf-8') as csvfile:
+        return {genre_category(row) for row in csv.DictReader(csvfile)}
+
+def list_audio_files(audio_files_directory):
+    """ The ISRCs with a .wav file in audio_files_directory, from one directory listing instead of a stat per track. """
+    with os.scandir(audio_files_directory) as entries:
+        return {entry.name[:-len('.wav')] for entry in entries if entry.name.endswith('.wav') and entry.is_file()}
+
+def write_genres_and_categories(genres_categories, output_file):
+    sorted_genres_categories = sorted(genres_categories, key=lambda x: x[3])
 
     with open(output_file, 'w', newline='', encoding='utf-8') as csvfile:
         writer = csv.writer(csvfile)
@@ -22,51 +25,39 @@ def get_genres_and_categories(tracks_file, output_file):
 
     print(f'Data has been successfully extracted, sorted by category name, and saved to {output_file}')
 
-def remove_tracks_by_genres_and_categories(tracks_file, genres_to_exclude_file, output_file):
-    genres_to_exclude = set()
+def clean_tracks(tracks_file, genres_to_exclude_file, audio_files_directory, output_file, genres_categories_file):
+    """ Keep the tracks outside the excluded genres that have an audio file, in one streaming pass over tracks_file.
 
-    with open(genres_to_exclude_file, 'r', newline='', encoding='utf-8') as csvfile:
-        reader = csv.DictReader(csvfile)
-        for row in reader:
-            genre_id = row['genre_id']
-            genre_name = row['genre_name']
-            category_id = row['category_id']
-            category_name = row['category_name']
-            genres_to_exclude.add((genre_id, genre_name, category_id, category_name))
+    Rows are written to output_file as they are read, and every genre and
+    category seen, excluded or not, is summarised in genres_categories_file.
+    """
+    genres_to_exclude = load_genres_to_exclude(genres_to_exclude_file)
+    audio_files = list_audio_files(audio_files_directory)
+    genres_categories = set()
+    counts = {'read': 0, 'excluded_genre': 0, 'without_audio': 0, 'kept': 0}
 
-    with open(tracks_file, 'r', newline='', encoding='utf-8') as csvfile:
-        reader = csv.DictReader(csvfile)
-        tracks_to_keep = [row for row in reader if (row['genre_id'], row['genre_name'], row['category_id'], row['category_name']) not in genres_to_exclude]
-
-    with open(output_file, 'w', newline='', encoding='utf-8') as csvfile:
-        fieldnames = ['isrc', 'title', 'spotify_uri', 'artist', 'genre_id', 'genre_name', 'category_id', 'category_name']
-        writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
+    with open(tracks_file, 'r', newline='', encoding='utf-8') as infile, open(output_file, 'w', newline='', encoding='utf-8') as outfile:
+        writer = csv.DictWriter(outfile, fieldnames=TRACK_FIELDS)
         writer.writeheader()
-        writer.writerows(tracks_to_keep)
-
-    print(f'Tracks have been successfully cleaned and saved to {output_file}')
-
-def remove_tracks_without_audiofile(input_file, output_file, audio_files_directory):
-    def audio_file_exists(isrc):
-        audio_file_path = os.path.join(audio_files_directory, f'{isrc}.wav')
-        return os.path.isfile(audio_file_path)
-
-    with open(input_file, 'r', newline='', encoding='utf-8') as csvfile:
-        reader = csv.DictReader(csvfile)
-        rows_with_audio = [row for row in reader if audio_file_exists(row['isrc'])]
-
-    with open(output_file, 'w', newline='', encoding='utf-8') as csvfile:
-        fieldnames = reader.fieldnames
-        writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
-        writer.writeheader()
-        writer.writerows(rows_with_audio)
-
-    print(f'Filtered tracks with existing audio files have been saved to {output_file}')
+        for row in csv.DictReader(infile):
+            counts['read'] += 1
+            key = genre_category(row)
+            genres_categories.add(key)
+            if key in genres_to_exclude:
+                counts['excluded_genre'] += 1
+            elif row['isrc'] not in audio_files:
+                counts['without_audio'] += 1
+            else:
+                counts['kept'] += 1
+                writer.writerow(row)
+
+    write_genres_and_categories(genres_categories, genres_categories_file)
+    print(f"{counts['kept']} of {counts['read']} tracks kept ({counts['excluded_genre']} in excluded genres, "
+          f"{counts['without_audio']} without an audio file) and saved to {output_file}")
+    return counts
 
 if __name__ == '__main__':
     tracks_file = "tracks.csv"
     audio_files_directory = "/Volumes/Samsung T7/tracks"
 
-    get_genres_and_categories(tracks_file, "genres_categories.csv")
-    remove_tracks_by_genres_and_categories(tracks_file, "genres_categories_to_exclude.csv", "tracks_genres_categories_cleaned.csv")
-    remove_tracks_without_audiofile("tracks_genres_categories_cleaned.csv", "tracks_cleaned.csv", audio_files_directory)
\ No newline at end of file
+    clean_tracks(tracks_file, "genres_categories_to_exclude.csv", audio_files_directory, "tracks_cleaned.csv", "genres_categories.csv")
@@ -0,0 +1,153 @@
+import os
+import json
+import fcntl
+import hashlib
+import numpy as np
+
+# Running total of the cached arrays' bytes, shared by every process using the cache
+SIZE_FILE = 'size.txt'
+
+
+class ArrayCache:
+    """ Content-addressed on-disk cache of intermediate frame-level arrays.
+
+    Entries are keyed by a hash of the audio file's bytes plus the extraction
+    parameters, and stored as .npy files that are read back memory-mapped.
+    Reads refresh an entry's mtime; once the cache grows past max_bytes the
+    least recently used files are deleted. The total size is kept in
+    SIZE_FILE and updated under a file lock on every store and eviction, so
+    pool workers share it and the cache is only walked to evict.
+    """
+
+    def __init__(self, root, max_bytes=50 * 1024**3):
+        self.root = root
+        self.max_bytes = max_bytes
+        os.makedirs(root, exist_ok=True)
+
+    def track(self, audio_path, **params):
+        return TrackCache(self, self.key(audio_path, **params))
+
+    def key(self, audio_path, **params):
+        digest = hashlib.sha256(file_digest(audio_path, self.root).encode())
+        digest.update(json.dumps(params, sort_keys=True).encode())
+        return digest.hexdigest()
+
+    def path(self, key, name):
+        return os.path.join(self.root, key[:2], key, f'{name}.npy')
+
+    def contains(self, key, name):
+        return os.path.exists(self.path(key, name))
+
+    def load(self, key, name):
+        path = self.path(key, name)
+        try:
+            array = np.load(path, mmap_mode='r')
+        except (FileNotFoundError, ValueError):
+            return None
+        os.utime(path)
+        return array
+
+    def store(self, key, name, array):
+        path = self.path(key, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'wb') as f:
+            np.save(f, array)
+        # Another worker may have stored the same array meanwhile; only the difference is new
+        replaced = os.path.getsize(path) if os.path.exists(path) else 0
+        os.replace(tmp_path, path)
+        self.add_bytes(os.path.getsize(path) - replaced)
+
+    def add_bytes(self, delta):
+        """ Add delta to the shared total, evicting if it is past max_bytes; returns the new total. """
+        with open(os.path.join(self.root, SIZE_FILE), 'a+') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            f.seek(0)
+            content = f.read().strip()
+            # Only a new cache, or one from before the size file, is walked to count it
+            total = int(content) + delta if content else self.size()
+            if total > self.max_bytes:
+                total = self.evict()
+            f.truncate(0)
+            f.write(str(total))
+            return total
+
+    def get_or_compute(self, key, name, compute):
+        array = self.load(key, name)
+        if array is None:
+            array = compute()
+            self.store(key, name, array)
+        return array
+
+    def entries(self):
+        for dirpath, _, filenames in os.walk(self.root):
+            for filename in filenames:
+                if filename.endswith('.npy'):
+                    path = os.path.join(dirpath, filename)
+                    try:
+                        stat = os.stat(path)
+                    except FileNotFoundError:
+                        continue  # Evicted by another worker
+                    yield stat.st_mtime, stat.st_size, path
+
+    def size(self):
+        return sum(size for _, size, _ in self.entries())
+
+    def evict(self):
+        """ Delete least recently used arrays until the cache is at most 90% of max_bytes; returns its size after.
+
+        Called by add_bytes with the size file locked.
+        """
+        entries = sorted(self.entries())
+        total = sum(size for _, size, _ in entries)
+        target = 0.9 * self.max_bytes
+        for _, size, path in entries:
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+        return total
+
+
+class TrackCache:
+    """ An ArrayCache bound to one track's key. """
+
+    def __init__(self, cache, key):
+        self.cache = cache
+        self.key = key
+
+    def has_all(self, names):
+        return all(self.cache.contains(self.key, name) for name in names)
+
+    def get(self, name, compute):
+        return self.cache.get_or_compute(self.key, name, compute)
+
+
+def file_digest(audio_path, cache_root, chunk_size=1 << 20):
+    """ SHA-256 of a file's contents, memoized on disk by path, size and mtime. """
+    stat = os.stat(audio_path)
+    memo_key = hashlib.sha1(os.path.abspath(audio_path).encode()).hexdigest()
+    memo_path = os.path.join(cache_root, 'digests', f'{memo_key}.json')
+    signature = [stat.st_size, stat.st_mtime_ns]
+    try:
+        with open(memo_path, 'r') as f:
+            memo = json.load(f)
+        if memo['signature'] == signature:
+            return memo['digest']
+    except (FileNotFoundError, ValueError, KeyError):
+        pass
+
+    digest = hashlib.sha256()
+    with open(audio_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+
+    os.makedirs(os.path.dirname(memo_path), exist_ok=True)
+    tmp_path = f'{memo_path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump({'signature': signature, 'digest': digest.hexdigest()}, f)
+    os.replace(tmp_path, memo_path)
+    return digest.hexdigest()
@@ -0,0 +1,149 @@
+import os
+import glob
+import json
+import argparse
+import traceback
+import numpy as np
+import librosa
+from concurrent.futures import ProcessPoolExecutor
+
+AUDIO_STORE_ENV = 'AUDIO_STORE'
+STORE_FILE = 'store.json'
+
+
+class AudioStore:
+    """ Decoded tracks kept as float32 .npy files, one per ISRC.
+
+    Each file holds what librosa.load(path, sr=sr, mono=False) returns for
+    the original track, so reading it back gives the same samples without
+    decoding or resampling. Files are opened memory-mapped: loading is
+    zero-copy, and processes reading the same track share the page cache.
+    Next to each file, {isrc}.source.json records the size and mtime of the
+    file it was decoded from, so a track whose source has changed is stale.
+
+    Opening a store only reads it; use AudioStore.create to start one.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        with open(os.path.join(root, STORE_FILE), 'r') as f:
+            self.sr = json.load(f)['sr']
+
+    @classmethod
+    def create(cls, root, sr=44100):
+        """ Open the store at root, starting an empty one at sample rate sr if there is none; raises ValueError if it holds another rate. """
+        os.makedirs(root, exist_ok=True)
+        store_path = os.path.join(root, STORE_FILE)
+        if not os.path.exists(store_path):
+            write_json(store_path, {'sr': sr})
+        store = cls(root)
+        if store.sr != sr:
+            raise ValueError(f"The audio store at {root} holds tracks decoded at {store.sr} Hz, not {sr} Hz")
+        return store
+
+    def path(self, isrc):
+        return os.path.join(self.root, f'{isrc}.npy')
+
+    def source_path(self, isrc):
+        return os.path.join(self.root, f'{isrc}.source.json')
+
+    def contains(self, isrc):
+        return os.path.exists(self.path(isrc))
+
+    def is_current(self, audio_path):
+        """ Whether the store holds a decode of audio_path as it is now. """
+        isrc = isrc_for(audio_path)
+        if not self.contains(isrc):
+            return False
+        try:
+            with open(self.source_path(isrc), 'r') as f:
+                return json.load(f) == source_stamp(audio_path)
+        except (OSError, ValueError):
+            return False
+
+    def load(self, isrc):
+        """ The stored (channels, samples) or (samples,) array, memory-mapped read-only. """
+        return np.load(self.path(isrc), mmap_mode='r')
+
+    def ingest(self, audio_path):
+        """ Decode audio_path into the store unless its current version is already there; returns its ISRC. """
+        isrc = isrc_for(audio_path)
+        if self.is_current(audio_path):
+            return isrc
+
+        # Stamped before decoding, so a source changed while it is read is stale the next time
+        stamp = source_stamp(audio_path)
+        y, _ = librosa.load(audio_path, sr=self.sr, mono=False)
+        path = self.path(isrc)
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'wb') as f:
+            np.save(f, y.astype(np.float32, copy=False))
+        os.replace(tmp_path, path)
+        write_json(self.source_path(isrc), stamp)
+        return isrc
+
+
+def isrc_for(audio_path):
+    return os.path.splitext(os.path.basename(audio_path))[0]
+
+def source_stamp(audio_path):
+    stat = os.stat(audio_path)
+    return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+def write_json(path, value):
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(value, f)
+    os.replace(tmp_path, path)
+
+def open_store():
+    """ The store named by the AUDIO_STORE environment variable, or None. """
+    root = os.environ.get(AUDIO_STORE_ENV)
+    if not root or not os.path.exists(os.path.join(root, STORE_FILE)):
+        return None
+    return AudioStore(root)
+
+def stored_audio(audio_path, sr):
+    """ The stored decode of audio_path at sample rate sr, or None if it is not in the store or its source has changed. """
+    store = open_store()
+    if store is None or store.sr != sr or not store.is_current(audio_path):
+        return None
+    return store.load(isrc_for(audio_path))
+
+def ingest_track(store, audio_path):
+    try:
+        return store.ingest(audio_path)
+    except Exception as e:
+        print(f"Error ingesting {audio_path}: {e}")
+        traceback.print_exc()
+        return None
+
+def ingest_directory(audio_directory, store, workers=1):
+    """ Decode every .wav in audio_directory that is not yet in the store, or has changed since it was decoded. """
+    audio_paths = [path for path in sorted(glob.glob(os.path.join(audio_directory, '*.wav')))
+                   if not store.is_current(path)]
+    print(f'Ingesting {len(audio_paths)} tracks into {store.root}')
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            for isrc in executor.map(ingest_track, [store] * len(audio_paths), audio_paths, chunksize=16):
+                if isrc:
+                    print(f'Ingested {isrc}')
+    else:
+        for audio_path in audio_paths:
+            if ingest_track(store, audio_path):
+                print(f'Ingested {isrc_for(audio_path)}')
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Decode the track catalog once into a memory-mapped float32 store.")
+    parser.add_argument("audio_dir", help="Directory of {isrc}.wav files")
+    parser.add_argument("store_dir", help="Directory the decoded .npy files are written to")
+    parser.add_argument("--sr", type=int, default=44100)
+    parser.add_argument("--workers", type=int, default=1)
+    args = parser.parse_args()
+
+    try:
+        store = AudioStore.create(args.store_dir, args.sr)
+    except ValueError as e:
+        print(f"Error: {e}")
+        raise SystemExit(1)
+    ingest_directory(args.audio_dir, store, args.workers)
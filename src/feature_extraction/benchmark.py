@@ -0,0 +1,319 @@
+import os
+import json
+import time
+import argparse
+import tempfile
+import numpy as np
+import pandas as pd
+import soundfile as sf
+from concurrent.futures import ProcessPoolExecutor
+
+from librosa_features import bandwidth, centroid, flatness, mfcc, zero_crossing_rate, chroma, spectral_contrast, rms
+from tempo import plp
+from loudness import analyze_loudness
+from instrumentation import peak_rss_mb
+from plotting import PLOTS_NONE
+from feature_store import FINGERPRINT_PREFIX
+
+SR = 44100
+BPM = 120
+TRACK_KINDS = ['tone', 'clicks', 'noise', 'mix', 'gap']
+DEFAULT_DURATIONS = [10, 60]
+SILENCE_PADDING = 1.0
+# Far less than extracting a track of MEMORY_CHECK_SECONDS takes, so the worker's address-space limit is hit
+MEMORY_CHECK_BUDGET_MB = 30
+MEMORY_CHECK_SECONDS = 120
+GAP_SECONDS = 2.0
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmark_baseline.json')
+
+# Which feature registry node of the track each benchmark gets, as the pipeline feeds it
+BENCHMARKS = {
+    'centroid': ('mono_trimmed', lambda signal, track: centroid(signal)),
+    'bandwidth': ('mono_trimmed', lambda signal, track: bandwidth(signal)),
+    'flatness': ('mono_trimmed', lambda signal, track: flatness(signal)),
+    'mfcc': ('mono_trimmed', lambda signal, track: mfcc(signal)),
+    'zero_crossing_rate': ('mono_trimmed', lambda signal, track: zero_crossing_rate(signal)),
+    'chroma': ('mono_trimmed', lambda signal, track: chroma(signal)),
+    'spectral_contrast': ('mono_trimmed', lambda signal, track: spectral_contrast(signal)),
+    'rms': ('mono_trimmed', lambda signal, track: rms(signal)),
+    'plp': ('mono', lambda signal, track: plp(signal, track['path'], BPM)),
+    'analyze_loudness': ('stereo_trimmed', lambda signal, track: analyze_loudness(signal)),
+    'process_audio_file': (None, lambda signal, track: process_track(track)),
+    'stream_features': (None, lambda signal, track: stream_track(track)),
+}
+
+
+def synthetic_track(kind, duration, sr=SR, seed=0):
+    """ A deterministic stereo test signal of duration seconds, padded with silence at both ends.
+
+    'tone' is a chord of harmonic tones with a slow amplitude swell, 'clicks'
+    a decaying click every beat at BPM over a quiet tone, 'noise' white noise,
+    'mix' all three together and 'gap' the mix with GAP_SECONDS of digital
+    silence in the middle, where loudness blocks are -inf.
+    """
+    rng = np.random.default_rng(seed)
+    t = np.arange(int(duration * sr)) / sr
+
+    tone = np.zeros_like(t)
+    for fundamental in [220.0, 277.18, 329.63]:
+        for harmonic in range(1, 5):
+            tone += np.sin(2 * np.pi * fundamental * harmonic * t) / harmonic
+    tone *= 0.1 * (0.75 + 0.25 * np.sin(2 * np.pi * 0.2 * t))
+
+    clicks = np.zeros_like(t)
+    click = np.exp(-np.arange(int(0.03 * sr)) / (0.005 * sr)) * np.sin(2 * np.pi * 1000 * np.arange(int(0.03 * sr)) / sr)
+    for start in (np.arange(0, duration, 60.0 / BPM) * sr).astype(int):
+        end = min(start + len(click), len(t))
+        clicks[start:end] += 0.8 * click[:end - start]
+
+    noise = 0.1 * rng.standard_normal(len(t))
+
+    signal = {
+        'tone': tone,
+        'clicks': clicks + 0.2 * tone,
+        'noise': noise,
+        'mix': 0.6 * tone + clicks + 0.5 * noise,
+        'gap': 0.6 * tone + clicks + 0.5 * noise,
+    }[kind]
+    if kind == 'gap':
+        middle = len(signal) // 2
+        signal[middle - int(GAP_SECONDS * sr / 2):middle + int(GAP_SECONDS * sr / 2)] = 0.0
+
+    padding = np.zeros(int(SILENCE_PADDING * sr))
+    mono = np.concatenate([padding, signal, padding])
+    return np.stack([mono, 0.8 * mono], axis=1).astype(np.float32)
+
+def write_tracks(directory, kinds, durations):
+    tracks = []
+    for duration in durations:
+        for seed, kind in enumerate(kinds):
+            name = f'{kind}_{duration}s'
+            path = os.path.join(directory, f'{name}.wav')
+            sf.write(path, synthetic_track(kind, duration, seed=seed), SR, subtype='PCM_16')
+            tracks.append({'name': name, 'path': path, 'seconds': duration + 2 * SILENCE_PADDING})
+    return tracks
+
+def process_track(track):
+    # Imported here so main.py's imports are not paid by the single-extractor benchmarks
+    from main import process_audio_file
+    result = process_audio_file(track['path'], BPM, track['name'], plot_mode=PLOTS_NONE, stream_above=None)
+    return {key: value for key, value in (result or {}).items() if key != 'isrc' and not key.startswith(FINGERPRINT_PREFIX)}
+
+def stream_track(track):
+    from streaming import stream_features
+    from features import extraction_params
+    return stream_features(track['path'], BPM, **extraction_params())
+
+def run_benchmark(name, tracks, repeat):
+    """ Time one benchmark over every track; runs in a fresh worker process so its peak RSS is its own. """
+    from features import registry
+    from feature_registry import Track
+    node, run = BENCHMARKS[name]
+    signals = {}
+    for track in tracks:
+        signals[track['name']] = registry.compute_nodes([node], Track(track['path'], BPM, track['name']))[node] if node else None
+    rss_before = peak_rss_mb()
+
+    # One untimed pass warms up numba and FFT plans
+    run(signals[tracks[0]['name']], tracks[0])
+
+    timings = []
+    outputs = {}
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for track in tracks:
+            outputs[track['name']] = run(signals[track['name']], track)
+        timings.append(time.perf_counter() - start)
+
+    best = min(timings)
+    return {
+        'seconds': best,
+        'tracks_per_second': len(tracks) / best,
+        'audio_seconds_per_second': sum(track['seconds'] for track in tracks) / best,
+        'peak_rss_mb': peak_rss_mb(),
+        'rss_growth_mb': peak_rss_mb() - rss_before,
+        'outputs': {track: {key: float(value) for key, value in stats.items()} for track, stats in outputs.items()},
+    }
+
+def compare(outputs, baseline, rtol=1e-4, atol=1e-4):
+    """ Compare benchmark outputs to baseline ones; returns a list of human-readable differences. """
+    differences = []
+    for track, expected in baseline.items():
+        actual = outputs.get(track)
+        if actual is None:
+            differences.append(f'{track}: missing')
+            continue
+        for key in sorted(set(expected) | set(actual)):
+            if key not in actual or key not in expected:
+                differences.append(f'{track}.{key}: only in {"baseline" if key in expected else "output"}')
+            elif not np.isclose(actual[key], expected[key], rtol=rtol, atol=atol, equal_nan=True):
+                differences.append(f'{track}.{key}: {actual[key]!r} != {expected[key]!r}')
+    return differences
+
+def check_streamed(streamed, expected):
+    """ Compare stream_features outputs to process_audio_file's for the same tracks, within STREAM_TOLERANCE.
+
+    The tempo of the pulseless 'tone' tracks is left out.
+    """
+    from streaming import compare_streamed
+    differences = []
+    for track, values in expected.items():
+        if track not in streamed:
+            differences.append(f'{track}: missing')
+            continue
+        if track.startswith('tone'):
+            # A steady tone has no pulse, so its PLP tempo curve follows noise in the onset envelope, which streaming tracks in windows
+            values = {name: value for name, value in values.items() if not name.startswith('tempo_')}
+            streamed_values = {name: value for name, value in streamed[track].items() if not name.startswith('tempo_')}
+        else:
+            streamed_values = streamed[track]
+        differences.extend(f'{track}.{difference}' for difference in compare_streamed(streamed_values, values))
+    return differences
+
+def check_reruns(directory, tracks):
+    """ Run main.process_csv twice over the shortest tracks, with a tempo of 0 for one of them; returns what went wrong.
+
+    The first run must stamp every feature, including the empty tempo of the
+    tempo-0 track, so the second finds nothing outdated and writes no part.
+    """
+    from main import process_csv, stale_features, load_cache
+    from feature_store import list_parts, read_fingerprints, fingerprint_column
+
+    shortest = min(track['seconds'] for track in tracks)
+    names = [track['name'] for track in tracks if track['seconds'] == shortest]
+    csv_path = os.path.join(directory, 'reruns.csv')
+    pd.DataFrame({'isrc': names, 'tempo': [0.0] + [float(BPM)] * (len(names) - 1)}).to_csv(csv_path, index=False)
+    output_path = os.path.join(directory, 'reruns.parquet')
+
+    problems = []
+    process_csv(csv_path, output_path, audio_directory=directory, plot_mode=PLOTS_NONE)
+    parts = list_parts(output_path)
+    if read_fingerprints(output_path)[fingerprint_column('tempo')].isna().any():
+        problems.append('a track without tempo features has no tempo fingerprint')
+    stale = stale_features(output_path, load_cache(output_path))
+    if stale:
+        problems.append(f'outdated after the first run: {stale}')
+    process_csv(csv_path, output_path, audio_directory=directory, plot_mode=PLOTS_NONE)
+    if list_parts(output_path) != parts:
+        problems.append(f'the second run wrote {len(list_parts(output_path)) - len(parts)} parts')
+    return problems
+
+def worker_pid(audio_path=None):
+    """ Extract audio_path, if given, then return the process ID of the worker that ran this. """
+    if audio_path is not None:
+        from main import process_audio_file
+        process_audio_file(audio_path, BPM, isrc_of(audio_path), plot_mode=PLOTS_NONE, stream_above=None)
+    return os.getpid()
+
+def isrc_of(audio_path):
+    return os.path.splitext(os.path.basename(audio_path))[0]
+
+def check_memory_budget(directory, tracks):
+    """ Run a long track over a small memory budget; returns what went wrong.
+
+    process_csv must quarantine it as over budget, and the pool must replace
+    the worker it ran in.
+    """
+    from main import process_csv
+    from feature_store import load_quarantine
+    from worker_pool import SupervisedPool, TASK_OK
+
+    budget_directory = os.path.join(directory, 'budget')
+    os.makedirs(budget_directory)
+    track = write_tracks(budget_directory, ['mix'], [MEMORY_CHECK_SECONDS])[0]
+    csv_path = os.path.join(budget_directory, 'budget.csv')
+    pd.DataFrame({'isrc': [track['name']], 'tempo': [float(BPM)]}).to_csv(csv_path, index=False)
+    output_path = os.path.join(budget_directory, 'budget.parquet')
+
+    # Workers are forked from this process: extracting a short track here first loads numba's JIT,
+    # which would not fit in the budget either, so the budget is then exceeded by the long track itself
+    worker_pid(min(tracks, key=lambda track: track['seconds'])['path'])
+    problems = []
+    process_csv(csv_path, output_path, audio_directory=budget_directory, plot_mode=PLOTS_NONE, memory_limit_mb=MEMORY_CHECK_BUDGET_MB)
+    reason = load_quarantine(output_path).get(track['name'])
+    if reason != 'memory budget exceeded':
+        problems.append(f'quarantined for {reason!r}, not the memory budget')
+
+    pool = SupervisedPool(1, worker_pid, memory_limit_mb=MEMORY_CHECK_BUDGET_MB)
+    results = list(pool.run([('before', ()), ('over', (track['path'],)), ('after', ())]))
+    pids = [value for _, status, value in results if status == TASK_OK]
+    if len(pids) != 2 or pids[0] == pids[1]:
+        problems.append(f'the worker was not replaced after exceeding its budget: {results}')
+    return problems
+
+def main(args):
+    names = args.only or list(BENCHMARKS)
+    with tempfile.TemporaryDirectory() as directory:
+        tracks = write_tracks(directory, TRACK_KINDS, args.durations)
+        results = {}
+        for name in names:
+            with ProcessPoolExecutor(max_workers=1) as executor:
+                results[name] = executor.submit(run_benchmark, name, tracks, args.repeat).result()
+            r = results[name]
+            print(f"{name:<20}{r['tracks_per_second']:>10.2f} tracks/s{r['audio_seconds_per_second']:>10.1f} audio-s/s"
+                  f"{r['peak_rss_mb']:>10.0f} MB peak{r['rss_growth_mb']:>8.0f} MB growth")
+
+        # Pipeline behaviour rather than extractor output, so only checked on full runs
+        problems = []
+        if not args.only:
+            with ProcessPoolExecutor(max_workers=1) as executor:
+                problems = executor.submit(check_reruns, directory, tracks).result()
+                problems += executor.submit(check_memory_budget, directory, tracks).result()
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline, 'r') as f:
+            baseline = json.load(f)
+    key = ','.join(str(d) for d in args.durations)
+
+    failed = bool(problems)
+    for problem in problems:
+        print(f'Pipeline check: {problem}')
+    if not args.save_baseline:
+        for name, result in results.items():
+            expected = baseline.get(key, {}).get(name)
+            if expected is None:
+                print(f'{name}: no baseline for durations {key}')
+                continue
+            differences = compare(result['outputs'], expected, args.rtol, args.atol)
+            if differences:
+                failed = True
+                print(f'{name}: {len(differences)} values differ from the baseline')
+                for difference in differences[:10]:
+                    print(f'  {difference}')
+
+    if 'stream_features' in results:
+        # The streamed statistics are checked against the in-memory ones of this run, or of the baseline
+        expected = results['process_audio_file']['outputs'] if 'process_audio_file' in results else baseline.get(key, {}).get('process_audio_file')
+        if expected is None:
+            print('stream_features: no in-memory outputs to check against')
+        else:
+            differences = check_streamed(results['stream_features']['outputs'], expected)
+            if differences:
+                failed = True
+                print(f'stream_features: {len(differences)} values differ from process_audio_file beyond the streaming tolerance')
+                for difference in differences[:10]:
+                    print(f'  {difference}')
+
+    if args.save_baseline:
+        baseline.setdefault(key, {}).update({name: result['outputs'] for name, result in results.items()})
+        with open(args.baseline, 'w') as f:
+            json.dump(baseline, f, indent=1, sort_keys=True)
+        print(f'Baseline written to {args.baseline}')
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({name: {k: v for k, v in r.items() if k != 'outputs'} for name, r in results.items()}, f, indent=2)
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the feature extractors on deterministic synthetic audio.")
+    parser.add_argument("--durations", type=int, nargs="+", default=DEFAULT_DURATIONS, help="Track lengths in seconds, before silence padding")
+    parser.add_argument("--repeat", type=int, default=3, help="Timed passes per benchmark; the fastest is reported")
+    parser.add_argument("--only", nargs="+", choices=list(BENCHMARKS), default=None)
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--save-baseline", action="store_true", help="Store this run's outputs as the baseline instead of comparing")
+    parser.add_argument("--rtol", type=float, default=1e-4, help="Relative tolerance of the baseline comparison")
+    parser.add_argument("--atol", type=float, default=1e-4, help="Absolute tolerance of the baseline comparison")
+    parser.add_argument("--output", default=None, help="Write throughput and memory figures to this JSON file")
+    raise SystemExit(main(parser.parse_args()))
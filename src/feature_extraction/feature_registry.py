@@ -0,0 +1,187 @@
+import json
+import hashlib
+import traceback
+from instrumentation import stage
+from utility_functions import raise_if_out_of_memory
+
+
+class Node:
+    """ An intermediate value computed from other nodes, e.g. the decoded audio or a spectrogram. """
+
+    def __init__(self, name, inputs, compute, required=False):
+        self.name = name
+        self.inputs = inputs
+        self.compute = compute
+        self.required = required
+
+
+class Feature:
+    """ A group of output columns, extracted from intermediate nodes with fixed parameters. """
+
+    def __init__(self, name, inputs, extract, definition, scaled=()):
+        self.name = name
+        self.inputs = inputs
+        self.extract = extract
+        self.definition = definition
+        self.scaled = scaled
+
+
+class Track:
+    """ What nodes and features know about the track being extracted. """
+
+    def __init__(self, audio_path, tempo, isrc, plot=False, cache=None):
+        self.audio_path = audio_path
+        self.tempo = tempo
+        self.isrc = isrc
+        self.plot = plot
+        self.cache = cache
+
+    def cached(self, name, compute):
+        """ compute(), or the array stored under name in the track's array cache. """
+        if self.cache is None:
+            return compute()
+        return self.cache.get(name, compute)
+
+
+class Inputs:
+    """ Lazy access to a node's or feature's inputs; each is computed on first use. """
+
+    def __init__(self, get):
+        self._get = get
+
+    def __getitem__(self, name):
+        return self._get(name)
+
+
+class FeatureRegistry:
+    """ Features and the intermediates they are computed from, as a dependency graph.
+
+    Each node and feature names the nodes it reads. For one track, run()
+    computes every node the requested features need at most once, in
+    dependency order, and drops a node's value as soon as its last consumer
+    has finished, so only the live part of the graph is held in memory.
+    Nodes are computed lazily, so inputs a cached intermediate makes
+    unnecessary (e.g. the decoded audio) are never computed at all.
+
+    scale() gives the factor applied to each feature's sample-counted
+    parameters, so one set of definitions serves every sample rate.
+    """
+
+    def __init__(self, fingerprint_params=None, scale=None):
+        self.nodes = {}
+        self.features = {}
+        self.fingerprint_params = fingerprint_params or (lambda definition: {})
+        self.scale = scale or (lambda: 1.0)
+
+    def node(self, name, inputs=(), required=False):
+        """ Register the decorated compute(inputs, track) as an intermediate node.
+
+        A failing node yields None to its consumers, unless it is required,
+        in which case the whole track fails.
+        """
+        def register(compute):
+            self.nodes[name] = Node(name, list(inputs), compute, required)
+            return compute
+        return register
+
+    def feature(self, name, inputs=(), version=1, scaled=(), **params):
+        """ Register the decorated extract(inputs, params, track) as a feature.
+
+        params are passed to extract and, with version, make up the
+        feature's definition: changing either changes its fingerprint.
+        The params named in scaled count samples and are multiplied by
+        scale(). Features are output in registration order.
+        """
+        def register(extract):
+            self.features[name] = Feature(name, list(inputs), extract, {'version': version, **params}, list(scaled))
+            return extract
+        return register
+
+    def params(self, name):
+        """ The definition of a feature with its sample-counted parameters scaled. """
+        feature = self.features[name]
+        factor = self.scale()
+        return {key: int(round(value * factor)) if key in feature.scaled else value for key, value in feature.definition.items()}
+
+    def fingerprint(self, name):
+        definition = self.params(name)
+        keyed = {**definition, **self.fingerprint_params(definition)}
+        return hashlib.sha1(json.dumps(keyed, sort_keys=True).encode()).hexdigest()[:16]
+
+    def run(self, names, track, eager=()):
+        """ Extract the named features of track, in registration order; returns {feature: summary stats}.
+
+        Nodes in eager are computed first, e.g. to fail an unreadable file
+        before any work is done.
+        """
+        features = [feature for name, feature in self.features.items() if name in names]
+        consumers = {}
+        pending = [input_name for feature in features for input_name in feature.inputs]
+        while pending:
+            name = pending.pop()
+            consumers[name] = consumers.get(name, 0) + 1
+            if consumers[name] == 1:
+                pending.extend(self.nodes[name].inputs)
+
+        values = {}
+        released = set()
+
+        def get(name):
+            if name not in values:
+                if name in released:
+                    raise RuntimeError(f"{name} was requested after its last declared consumer")
+                values[name] = self._compute(self.nodes[name], Inputs(get), track)
+                release_inputs(name)
+            return values[name]
+
+        def release_inputs(name):
+            released.add(name)
+            for input_name in self.nodes[name].inputs:
+                done_with(input_name)
+
+        def done_with(name):
+            consumers[name] -= 1
+            if consumers[name] == 0:
+                values.pop(name, None)
+                if name not in released:
+                    # Never needed after all: its own inputs are done with too
+                    release_inputs(name)
+
+        for name in eager:
+            if name in consumers:
+                get(name)
+
+        outputs = {}
+        for feature in features:
+            with stage(feature.name):
+                outputs[feature.name] = feature.extract(Inputs(get), self.params(feature.name), track)
+            for input_name in feature.inputs:
+                done_with(input_name)
+        return outputs
+
+    def compute_nodes(self, names, track):
+        """ The named nodes of track, computed with the nodes they read, as {node: value}.
+
+        Unlike run(), nothing is released; for benchmarks that time an
+        extractor on the exact signal the pipeline gives it.
+        """
+        values = {}
+
+        def get(name):
+            if name not in values:
+                values[name] = self._compute(self.nodes[name], Inputs(get), track)
+            return values[name]
+
+        return {name: get(name) for name in names}
+
+    def _compute(self, node, inputs, track):
+        with stage(node.name):
+            if node.required:
+                return node.compute(inputs, track)
+            try:
+                return node.compute(inputs, track)
+            except Exception as e:
+                raise_if_out_of_memory(e)
+                print(f"Error computing {node.name}: {e}")
+                traceback.print_exc()
+                return None
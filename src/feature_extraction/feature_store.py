@@ -0,0 +1,198 @@
+import os
+import json
+import time
+import glob
+import pandas as pd
+import pyarrow.parquet as pq
+from instrumentation import stage
+
+PART_PATTERN = 'part-*.parquet'
+# Sidecar files start with an underscore so pd.read_parquet on the directory skips them
+DONE_FILE = '_done.txt'
+QUARANTINE_FILE = '_quarantine.jsonl'
+LEGACY_SIDECARS = {'done.txt': DONE_FILE, 'quarantine.jsonl': QUARANTINE_FILE}
+FINGERPRINT_PREFIX = 'fingerprint_'
+
+
+class FeatureWriter:
+    """ Buffered Parquet writer for extracted feature rows.
+
+    Rows are held in memory and written as one Parquet part file per flush,
+    every flush_rows rows or flush_seconds seconds, whichever comes first.
+    Each part is written to a temporary file and renamed into place, so a
+    crash can lose the unflushed buffer but never leaves a partial part.
+    """
+
+    def __init__(self, output_path, flush_rows=256, flush_seconds=60.0):
+        self.output_path = output_path
+        self.flush_rows = flush_rows
+        self.flush_seconds = flush_seconds
+        self.buffer = []
+        self.last_flush = time.monotonic()
+        os.makedirs(output_path, exist_ok=True)
+
+    def write(self, row):
+        self.buffer.append(row)
+        if len(self.buffer) >= self.flush_rows or time.monotonic() - self.last_flush >= self.flush_seconds:
+            self.flush()
+
+    def flush(self):
+        self.last_flush = time.monotonic()
+        if not self.buffer:
+            return
+
+        with stage('write'):
+            write_part(self.output_path, pd.DataFrame(self.buffer))
+        self.buffer = []
+
+    def close(self):
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.close()
+
+
+def write_part(output_path, df):
+    """ Atomically write df as a new part file of output_path and index its ISRCs. """
+    name = f'part-{time.time_ns():020d}-{os.getpid()}.parquet'
+    tmp_path = os.path.join(output_path, f'.{name}.tmp')
+    df.to_parquet(tmp_path, index=False)
+    with open(tmp_path, 'rb') as f:
+        os.fsync(f.fileno())
+    os.replace(tmp_path, os.path.join(output_path, name))
+    record_done(output_path, name, df['isrc'])
+
+def list_parts(output_path):
+    return sorted(glob.glob(os.path.join(output_path, PART_PATTERN)))
+
+def record_done(output_path, part_name, isrcs):
+    """ Append a part's ISRCs to the done index, followed by a marker line for the part itself. """
+    with open(os.path.join(output_path, DONE_FILE), 'a', encoding='utf-8') as f:
+        f.writelines(f'{isrc}\n' for isrc in isrcs)
+        f.write(f'# {part_name}\n')
+        f.flush()
+        os.fsync(f.fileno())
+
+def load_done(output_path):
+    """ Return the set of ISRCs already written to output_path.
+
+    Only the done index is read. Parts missing from it, e.g. after a crash
+    between writing a part and indexing it, are indexed from their ISRC column.
+    """
+    done = set()
+    indexed_parts = set()
+    done_path = os.path.join(output_path, DONE_FILE)
+    if os.path.exists(done_path):
+        with open(done_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                line = line.rstrip('\n')
+                if line.startswith('# '):
+                    indexed_parts.add(line[2:])
+                elif line:
+                    done.add(line)
+
+    for part in list_parts(output_path):
+        name = os.path.basename(part)
+        if name not in indexed_parts:
+            isrcs = pd.read_parquet(part, columns=['isrc'])['isrc'].astype(str)
+            record_done(output_path, name, isrcs)
+            done.update(isrcs)
+    return done
+
+def rename_legacy_sidecars(output_path):
+    """ Move sidecar files written under their old names, which made the directory unreadable as a Parquet dataset. """
+    for legacy, name in LEGACY_SIDECARS.items():
+        legacy_path = os.path.join(output_path, legacy)
+        if os.path.exists(legacy_path) and not os.path.exists(os.path.join(output_path, name)):
+            os.replace(legacy_path, os.path.join(output_path, name))
+
+def quarantine_path(output_path):
+    return os.path.join(output_path, QUARANTINE_FILE)
+
+def record_quarantine(output_path, isrc, reason):
+    path = quarantine_path(output_path)
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(path, 'a', encoding='utf-8') as f:
+        f.write(json.dumps({'isrc': isrc, 'reason': reason, 'time': time.time()}) + '\n')
+
+def load_quarantine(output_path):
+    """ Map of quarantined ISRC to the reason it last failed. """
+    path = quarantine_path(output_path)
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'r', encoding='utf-8') as f:
+        entries = [json.loads(line) for line in f if line.strip()]
+    return {entry['isrc']: entry['reason'] for entry in entries}
+
+def read_features(path, columns=None):
+    """ Read a feature table written by FeatureWriter, or a legacy CSV.
+
+    Parts are read in write order and later rows win when an ISRC appears
+    more than once.
+    """
+    if not os.path.isdir(path):
+        return pd.read_csv(path, usecols=columns)
+
+    parts = [pd.read_parquet(part, columns=columns) for part in list_parts(path)]
+    if not parts:
+        return pd.DataFrame(columns=columns)
+
+    df = pd.concat(parts, ignore_index=True)
+    return df.drop_duplicates(subset='isrc', keep='last').reset_index(drop=True)
+
+def migrate_csv(csv_path):
+    """ Import a legacy single-CSV output as the first part of a sibling Parquet directory and return its path.
+
+    The directory is named after the CSV with a .parquet extension. If it
+    already exists the CSV was imported before and is left alone, so rows
+    written since are not overwritten by the older ones.
+    """
+    output_path = os.path.splitext(csv_path)[0] + '.parquet'
+    if os.path.isdir(output_path):
+        print(f"{csv_path} was already migrated to {output_path}")
+        return output_path
+    df = pd.read_csv(csv_path)
+    os.makedirs(output_path)
+    if len(df):
+        write_part(output_path, df)
+    print(f"Migrated {len(df)} rows from {csv_path} to {output_path}")
+    return output_path
+
+def fingerprint_column(feature_name):
+    return f'{FINGERPRINT_PREFIX}{feature_name}'
+
+def read_fingerprints(output_path):
+    """ The fingerprint columns of the latest row per ISRC, indexed by ISRC.
+
+    Only those columns are read from each part; parts written before
+    fingerprints existed contribute rows of NaN.
+    """
+    frames = []
+    for part in list_parts(output_path):
+        names = pq.read_schema(part).names
+        frames.append(pd.read_parquet(part, columns=['isrc'] + [name for name in names if name.startswith(FINGERPRINT_PREFIX)]))
+    if not frames:
+        return pd.DataFrame(columns=['isrc']).set_index('isrc')
+    df = pd.concat(frames, ignore_index=True)
+    df['isrc'] = df['isrc'].astype(str)
+    return df.drop_duplicates(subset='isrc', keep='last').set_index('isrc')
+
+def stamp_fingerprints(output_path, fingerprints):
+    """ Mark every stored feature group with fingerprints, a map of feature name to fingerprint.
+
+    For adopting rows written before fingerprints existed without
+    recomputing them: the rows are rewritten as one new part.
+    """
+    df = read_features(output_path)
+    for feature_name, fingerprint in fingerprints.items():
+        if any(column.startswith(f'{feature_name}_') for column in df.columns):
+            df[fingerprint_column(feature_name)] = fingerprint
+    if len(df):
+        write_part(output_path, df)
+
+def export_csv(path, csv_path):
+    df = read_features(path)
+    df.drop(columns=[column for column in df.columns if column.startswith(FINGERPRINT_PREFIX)]).to_csv(csv_path, index=False)
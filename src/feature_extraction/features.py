@@ -0,0 +1,132 @@
+import librosa
+from feature_registry import FeatureRegistry
+from loudness import analyze_loudness, block_loudness
+from librosa_features import bandwidth, centroid, flatness, mfcc, zero_crossing_rate, chroma, spectral_contrast, rms
+from tempo import plp, onset_strength
+from spectral_context import SpectralContext
+from utility_functions import decode_audio, as_samples_by_channels, trim_silence
+
+# Everything the cached intermediate arrays depend on, at the full profile's rate; part of their cache key
+EXTRACTION_PARAMS = {'sr': 44100, 'n_fft': 4096, 'hop_length': 1024, 'mono_top_db': 60, 'stereo_top_db': 10,
+                     'plp_hop_length': 512, 'loudness_block_size': 0.4}
+SAMPLE_PARAMS = ['n_fft', 'hop_length', 'plp_hop_length']
+SIGNAL_TOP_DB = {'mono': None, 'mono_trimmed': EXTRACTION_PARAMS['mono_top_db'], 'stereo_trimmed': EXTRACTION_PARAMS['stereo_top_db']}
+
+# Sample rate of each extraction profile. Sizes counted in samples scale with it, so
+# frames span the same time; 'fast' drops the content above 11 kHz for half the work.
+PROFILES = {'full': 44100, 'fast': 22050}
+DEFAULT_PROFILE = 'full'
+
+_active_profile = DEFAULT_PROFILE
+
+
+def use_profile(profile):
+    """ Extract at the sample rate of profile in this process. """
+    global _active_profile
+    if profile not in PROFILES:
+        raise ValueError(f"Unknown extraction profile {profile!r}; choose from {', '.join(PROFILES)}")
+    _active_profile = profile
+
+def profile_sr():
+    return PROFILES[_active_profile]
+
+def profile_scale():
+    return profile_sr() / EXTRACTION_PARAMS['sr']
+
+def extraction_params():
+    """ EXTRACTION_PARAMS for the active profile. """
+    params = {key: int(round(value * profile_scale())) if key in SAMPLE_PARAMS else value for key, value in EXTRACTION_PARAMS.items()}
+    params['sr'] = profile_sr()
+    return params
+
+def cached_arrays():
+    """ The intermediate arrays that, when all cached, make decoding a track unnecessary. """
+    return ['magnitude', 'mel', f"rms_{registry.params('RMS Energy')['frame_length']}", 'zero_crossing_rate', 'onset_envelope', 'loudness_blocks']
+
+
+# A feature's fingerprint also covers the sample rate and the trim of the signal it reads
+registry = FeatureRegistry(lambda definition: {'sr': profile_sr(), 'top_db': SIGNAL_TOP_DB[definition['signal']]},
+                           scale=profile_scale)
+
+
+@registry.node('audio', required=True)
+def decoded_audio(inputs, track):
+    return decode_audio(track.audio_path, sr=profile_sr())
+
+@registry.node('mono', inputs=['audio'])
+def mono(inputs, track):
+    return librosa.to_mono(inputs['audio'])
+
+@registry.node('mono_trimmed', inputs=['mono'])
+def mono_trimmed(inputs, track):
+    y, _ = librosa.effects.trim(inputs['mono'], top_db=EXTRACTION_PARAMS['mono_top_db'])
+    # A copy, so the untrimmed signal can be freed once its other consumers are done
+    return y.copy()
+
+@registry.node('stereo_trimmed', inputs=['audio'])
+def stereo_trimmed(inputs, track):
+    return as_samples_by_channels(trim_silence(inputs['audio'], threshold=EXTRACTION_PARAMS['stereo_top_db'])).copy()
+
+@registry.node('spectrogram', inputs=['mono_trimmed'])
+def spectrogram(inputs, track):
+    params = extraction_params()
+    # Nothing is computed yet: each extractor builds only the arrays it reads, e.g. no STFT for ZCR and RMS alone
+    return SpectralContext(lambda: inputs['mono_trimmed'], params['sr'], params['n_fft'], params['hop_length'], cache=track.cache)
+
+@registry.node('onset_envelope', inputs=['mono'])
+def onset_envelope(inputs, track):
+    params = extraction_params()
+    return track.cached('onset_envelope', lambda: onset_strength(inputs['mono'], params['sr'], params['plp_hop_length']))
+
+@registry.node('loudness_blocks', inputs=['stereo_trimmed'])
+def loudness_blocks(inputs, track):
+    params = extraction_params()
+    return track.cached('loudness_blocks', lambda: block_loudness(inputs['stereo_trimmed'], params['sr'], params['loudness_block_size']))
+
+
+# The spectral extractors read the trimmed signal through the context for anything not cached or
+# computed with other params, so it is kept until the last of them is done
+SPECTRAL_INPUTS = ['spectrogram', 'mono_trimmed']
+
+# PLP's win_length counts onset frames, not samples
+@registry.feature('tempo', inputs=['onset_envelope'], scaled=['hop_length'], signal='mono', hop_length=EXTRACTION_PARAMS['plp_hop_length'], win_length=1024)
+def tempo_features(inputs, params, track):
+    return plp(None, track.audio_path, track.tempo, profile_sr(), params['hop_length'], params['win_length'], plot_graph=track.plot,
+               onset_envelope=inputs['onset_envelope'])
+
+@registry.feature('loudness', inputs=['loudness_blocks'], signal='stereo_trimmed', block_size=EXTRACTION_PARAMS['loudness_block_size'])
+def loudness_features(inputs, params, track):
+    return analyze_loudness(None, profile_sr(), params['block_size'], plot_graph=track.plot, loudness=inputs['loudness_blocks'])
+
+@registry.feature('centroid', inputs=SPECTRAL_INPUTS, scaled=['n_fft', 'hop_length'], signal='mono_trimmed', n_fft=4096, hop_length=1024)
+def centroid_features(inputs, params, track):
+    return centroid(None, profile_sr(), params['hop_length'], params['n_fft'], plot=track.plot, ctx=inputs['spectrogram'])
+
+@registry.feature('bandwidth', inputs=SPECTRAL_INPUTS, scaled=['n_fft', 'hop_length'], signal='mono_trimmed', n_fft=4096, hop_length=1024)
+def bandwidth_features(inputs, params, track):
+    return bandwidth(None, profile_sr(), params['hop_length'], params['n_fft'], plot=track.plot, ctx=inputs['spectrogram'])
+
+@registry.feature('flatness', inputs=SPECTRAL_INPUTS, scaled=['n_fft', 'hop_length'], signal='mono_trimmed', n_fft=4096, hop_length=1024)
+def flatness_features(inputs, params, track):
+    return flatness(None, params['hop_length'], params['n_fft'], plot=track.plot, ctx=inputs['spectrogram'])
+
+@registry.feature('zero_crossing', inputs=SPECTRAL_INPUTS, scaled=['hop_length'], signal='mono_trimmed', hop_length=1024)
+def zero_crossing_features(inputs, params, track):
+    return zero_crossing_rate(None, params['hop_length'], plot=track.plot, sr=profile_sr(), ctx=inputs['spectrogram'])
+
+@registry.feature('RMS Energy', inputs=SPECTRAL_INPUTS, scaled=['hop_length', 'frame_length'], signal='mono_trimmed', hop_length=1024, frame_length=4096)
+def rms_features(inputs, params, track):
+    return rms(None, params['hop_length'], params['frame_length'], plot=track.plot, sr=profile_sr(), ctx=inputs['spectrogram'])
+
+@registry.feature('mfcc', inputs=SPECTRAL_INPUTS, scaled=['n_fft', 'hop_length', 'win_length'], signal='mono_trimmed', n_fft=4096, hop_length=1024, win_length=4096, n_mfcc=13)
+def mfcc_features(inputs, params, track):
+    return mfcc(None, profile_sr(), params['hop_length'], params['n_fft'], params['win_length'], params['n_mfcc'], plot=track.plot,
+                ctx=inputs['spectrogram'])
+
+@registry.feature('chroma', inputs=SPECTRAL_INPUTS, scaled=['n_fft', 'hop_length'], signal='mono_trimmed', n_fft=4096, hop_length=1024)
+def chroma_features(inputs, params, track):
+    return chroma(None, profile_sr(), params['hop_length'], params['n_fft'], plot=track.plot, ctx=inputs['spectrogram'])
+
+@registry.feature('spectral_contrast', inputs=SPECTRAL_INPUTS, scaled=['n_fft', 'hop_length'], signal='mono_trimmed', n_fft=4096, hop_length=1024)
+def spectral_contrast_features(inputs, params, track):
+    return spectral_contrast(None, profile_sr(), params['hop_length'], params['n_fft'], plot=track.plot, ctx=inputs['spectrogram'])
@@ -0,0 +1,172 @@
+import os
+import sys
+import json
+import time
+import uuid
+import resource
+import tracemalloc
+import numpy as np
+from contextlib import contextmanager
+
+# Upper bucket edges of the per-stage duration histograms, in milliseconds
+HISTOGRAM_EDGES_MS = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, 30000, 60000, float('inf')]
+
+_active = None
+
+
+class Instrumentation:
+    """ Per-track stage timings and memory use, appended to a JSON-lines log.
+
+    Each record carries the run id, so one log can hold several runs and
+    report() picks out a single one. By default a stage costs two clock
+    reads and a getrusage call; memory is the growth of the process's peak
+    RSS. With trace_allocations, tracemalloc also measures the bytes each
+    top-level stage allocates at its peak, which is much slower.
+    The object pickles into pool workers, which append to the same log.
+    """
+
+    def __init__(self, log_path, trace_allocations=False, run_id=None):
+        self.log_path = log_path
+        self.trace_allocations = trace_allocations
+        self.run_id = run_id or uuid.uuid4().hex[:12]
+        self._track = None
+        self._depth = 0
+
+    def start_track(self, isrc):
+        if self.trace_allocations and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        self._track = {'kind': 'track', 'run_id': self.run_id, 'isrc': isrc, 'pid': os.getpid(),
+                       'started': time.time(), 'stages': {}}
+        self._track_start = time.perf_counter()
+        self._depth = 0
+
+    def finish_track(self, status='ok'):
+        if self._track is None:
+            return
+        self._track['status'] = status
+        self._track['seconds'] = time.perf_counter() - self._track_start
+        self._track['peak_rss_mb'] = peak_rss_mb()
+        self.write(self._track)
+        self._track = None
+
+    @contextmanager
+    def stage(self, name):
+        top_level = self._depth == 0
+        trace = self.trace_allocations and top_level and tracemalloc.is_tracing()
+        if trace:
+            tracemalloc.reset_peak()
+            traced_before = tracemalloc.get_traced_memory()[0]
+        rss_before = peak_rss_mb()
+        start = time.perf_counter()
+        self._depth += 1
+        try:
+            yield
+        finally:
+            self._depth -= 1
+            measured = {'seconds': time.perf_counter() - start, 'rss_growth_mb': peak_rss_mb() - rss_before}
+            if trace:
+                measured['alloc_peak_mb'] = (tracemalloc.get_traced_memory()[1] - traced_before) / 1024**2
+            self._add(name, measured)
+
+    def _add(self, name, measured):
+        if self._track is None:
+            # Outside a track, e.g. writing a part file: the stage is its own record
+            self.write({'kind': 'stage', 'run_id': self.run_id, 'stage': name, 'pid': os.getpid(), **measured})
+            return
+        stages = self._track['stages']
+        if name in stages:
+            # Stages run several times per track (summary statistics) are summed
+            for key, value in measured.items():
+                stages[name][key] = stages[name].get(key, 0.0) + value
+            stages[name]['calls'] += 1
+        else:
+            stages[name] = {**measured, 'calls': 1}
+
+    def write(self, record):
+        # One short append per record; lines from concurrent workers do not interleave
+        with open(self.log_path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(record) + '\n')
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_track'] = None
+        return state
+
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    scale = 1024**2 if sys.platform == 'darwin' else 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale
+
+def use_instrumentation(instrumentation):
+    """ Make instrumentation the target of stage() in this process; None turns stage() into a no-op. """
+    global _active
+    _active = instrumentation
+
+@contextmanager
+def stage(name):
+    if _active is None:
+        yield
+    else:
+        with _active.stage(name):
+            yield
+
+def read_records(log_path, run_id=None):
+    if not os.path.exists(log_path):
+        return []
+    with open(log_path, 'r', encoding='utf-8') as f:
+        records = [json.loads(line) for line in f if line.strip()]
+    if run_id is not None:
+        records = [record for record in records if record.get('run_id') == run_id]
+    return records
+
+def report(log_path, run_id=None):
+    """ Aggregate a run's records into per-stage duration percentiles, histograms and memory peaks. """
+    records = read_records(log_path, run_id)
+    tracks = [record for record in records if record['kind'] == 'track']
+    samples = {}
+    for record in tracks:
+        samples.setdefault('track', []).append({'seconds': record['seconds'], 'rss_growth_mb': 0.0})
+        for name, measured in record['stages'].items():
+            samples.setdefault(name, []).append(measured)
+    for record in records:
+        if record['kind'] == 'stage':
+            samples.setdefault(record['stage'], []).append(record)
+
+    stages = {}
+    for name, measurements in samples.items():
+        seconds = np.array([m['seconds'] for m in measurements])
+        milliseconds = seconds * 1000
+        bucket_counts = np.bincount(np.searchsorted(HISTOGRAM_EDGES_MS, milliseconds), minlength=len(HISTOGRAM_EDGES_MS))
+        p50, p90, p99 = np.percentile(milliseconds, [50, 90, 99])
+        stages[name] = {
+            'count': len(measurements),
+            'total_seconds': float(seconds.sum()),
+            'mean_ms': float(milliseconds.mean()),
+            'p50_ms': float(p50),
+            'p90_ms': float(p90),
+            'p99_ms': float(p99),
+            'max_ms': float(milliseconds.max()),
+            'max_rss_growth_mb': float(max(m.get('rss_growth_mb', 0.0) for m in measurements)),
+            'histogram_ms': {str(edge): int(count) for edge, count in zip(HISTOGRAM_EDGES_MS, bucket_counts) if count},
+        }
+        allocations = [m['alloc_peak_mb'] for m in measurements if 'alloc_peak_mb' in m]
+        if allocations:
+            stages[name]['max_alloc_peak_mb'] = float(max(allocations))
+
+    return {
+        'run_id': run_id,
+        'tracks': len(tracks),
+        'failed_tracks': sum(record['status'] != 'ok' for record in tracks),
+        'peak_rss_mb': max((record['peak_rss_mb'] for record in tracks), default=0.0),
+        'stages': stages,
+    }
+
+def print_report(summary):
+    print(f"Run {summary['run_id']}: {summary['tracks']} tracks, {summary['failed_tracks']} failed, "
+          f"peak RSS {summary['peak_rss_mb']:.0f} MB")
+    print(f"{'stage':<20}{'count':>8}{'total s':>10}{'mean ms':>10}{'p50 ms':>10}{'p90 ms':>10}{'p99 ms':>10}{'max ms':>10}{'RSS+ MB':>9}")
+    ordered = sorted(summary['stages'].items(), key=lambda item: -item[1]['total_seconds'])
+    for name, s in ordered:
+        print(f"{name:<20}{s['count']:>8}{s['total_seconds']:>10.1f}{s['mean_ms']:>10.1f}{s['p50_ms']:>10.1f}"
+              f"{s['p90_ms']:>10.1f}{s['p99_ms']:>10.1f}{s['max_ms']:>10.1f}{s['max_rss_growth_mb']:>9.1f}")
@@ -1,9 +1,10 @@
 import numpy as np
 import librosa
-import matplotlib.pyplot as plt
 import traceback
 from typing import Dict
-from utility_functions import extract_summary_statistics, load_audio_mono
+from utility_functions import extract_summary_statistics, extract_band_statistics, load_audio_mono, ExtractionFailed, raise_if_out_of_memory
+from spectral_context import SpectralContext, spectral_context_for, signal_for
+from plotting import render_plot, finish_figure
 
 def calculate_time_axis(y: np.ndarray, sr: int = 44100) -> np.ndarray:
     return np.arange(0, len(y)) / sr
@@ -12,119 +13,136 @@ def calculate_time_axis_for_frames(y: np.ndarray, sr: int = 44100, hop_length: i
     n_frames = int(np.ceil(len(y) / hop_length))
     return np.arange(0, n_frames) * hop_length / sr
 
-def bandwidth(y: np.ndarray, sr: int = 44100, hop_length: int = 1024, n_fft: int = 4096, plot: bool = False) -> Dict:
+def bandwidth(y: np.ndarray, sr: int = 44100, hop_length: int = 1024, n_fft: int = 4096, plot: bool = False, ctx: SpectralContext = None) -> Dict:
     try:
-        bw = librosa.feature.spectral_bandwidth(y=y, sr=sr, hop_length=hop_length, n_fft=n_fft)
+        spec = spectral_context_for(y, sr, n_fft, hop_length, ctx)
+        bw = librosa.feature.spectral_bandwidth(S=spec.magnitude, sr=sr, hop_length=hop_length, n_fft=n_fft)
         stats = extract_summary_statistics('bandwidth', 1, bw)
         if plot:
-            plot_feature(bw, calculate_time_axis_for_frames(y, sr, hop_length), 'Bandwidth')
+            render_plot(plot_feature, bw, librosa.times_like(bw, sr=sr, hop_length=hop_length), 'Bandwidth')
         return stats
     except Exception as e:
+        raise_if_out_of_memory(e)
         print(f"Error in bandwidth: {e}")
         traceback.print_exc()
-        return {}
+        return ExtractionFailed()
 
-def flatness(y: np.ndarray, hop_length: int = 1024, n_fft: int = 4096, plot: bool = False) -> Dict:
+def flatness(y: np.ndarray, hop_length: int = 1024, n_fft: int = 4096, plot: bool = False, ctx: SpectralContext = None) -> Dict:
     try:
-        fl = librosa.feature.spectral_flatness(y=y, hop_length=hop_length, n_fft=n_fft)
+        sr = ctx.sr if ctx is not None else 44100
+        spec = spectral_context_for(y, sr, n_fft, hop_length, ctx)
+        fl = librosa.feature.spectral_flatness(S=spec.magnitude, hop_length=hop_length, n_fft=n_fft)
         stats = extract_summary_statistics('flatness', 1, fl)
         if plot:
-            plot_feature(fl, calculate_time_axis_for_frames(y, sr, hop_length), 'Flatness')
+            render_plot(plot_feature, fl, librosa.times_like(fl, sr=sr, hop_length=hop_length), 'Flatness')
         return stats
     except Exception as e:
+        raise_if_out_of_memory(e)
         print(f"Error in flatness: {e}")
         traceback.print_exc()
-        return {}
+        return ExtractionFailed()
 
-def centroid(y: np.ndarray, sr: int = 44100, hop_length: int = 1024, n_fft: int = 4096, plot: bool = False) -> Dict:
+def centroid(y: np.ndarray, sr: int = 44100, hop_length: int = 1024, n_fft: int = 4096, plot: bool = False, ctx: SpectralContext = None) -> Dict:
     try:
-        cent = librosa.feature.spectral_centroid(y=y, sr=sr, hop_length=hop_length, n_fft=n_fft)
+        spec = spectral_context_for(y, sr, n_fft, hop_length, ctx)
+        cent = librosa.feature.spectral_centroid(S=spec.magnitude, sr=sr, hop_length=hop_length, n_fft=n_fft)
         stats = extract_summary_statistics('centroid', 1, cent)
         if plot:
-            plot_feature(cent, calculate_time_axis_for_frames(y, sr, hop_length), 'Centroid')
+            render_plot(plot_feature, cent, librosa.times_like(cent, sr=sr, hop_length=hop_length), 'Centroid')
         return stats
     except Exception as e:
+        raise_if_out_of_memory(e)
         print(f"Error in centroid: {e}")
         traceback.print_exc()
-        return {}
+        return ExtractionFailed()
 
-def mfcc(y: np.ndarray, sr: int = 44100, hop_length: int = 1024, n_fft: int = 4096, win_length: int = 4096, n_mfcc: int = 13, plot: bool = False) -> Dict:
+def mfcc(y: np.ndarray, sr: int = 44100, hop_length: int = 1024, n_fft: int = 4096, win_length: int = 4096, n_mfcc: int = 13, plot: bool = False, ctx: SpectralContext = None) -> Dict:
     try:
-        mfccs = librosa.feature.mfcc(y=y, sr=sr, n_mfcc=n_mfcc, hop_length=hop_length, n_fft=n_fft, win_length=win_length)
-        stats = {}
-        for i, mfcc_band in enumerate(mfccs):
-            band_stats = extract_summary_statistics('mfcc', i + 1, mfcc_band)
-            stats.update(band_stats)
+        if win_length == n_fft:
+            spec = spectral_context_for(y, sr, n_fft, hop_length, ctx)
+            mfccs = librosa.feature.mfcc(S=spec.log_mel, sr=sr, n_mfcc=n_mfcc)
+        else:
+            # The shared context only holds full-window spectrograms
+            mfccs = librosa.feature.mfcc(y=signal_for(y, ctx), sr=sr, n_mfcc=n_mfcc, hop_length=hop_length, n_fft=n_fft, win_length=win_length)
+        stats = extract_band_statistics('mfcc', mfccs)
         if plot:
             # for i, mfcc_band in enumerate(mfccs):
             #     plot_feature(mfcc_band, calculate_time_axis_for_frames(y, sr, hop_length), f'MFCC {i + 1}')
-            plot_mfcc(mfccs, sr, hop_length)
+            render_plot(plot_mfcc, mfccs, sr, hop_length)
         return stats
     except Exception as e:
+        raise_if_out_of_memory(e)
         print(f"Error in mfcc: {e}")
         traceback.print_exc()
-        return {}
+        return ExtractionFailed()
 
-def zero_crossing_rate(y: np.ndarray, hop_length: int = 1024, plot: bool = False) -> Dict:
+def zero_crossing_rate(y: np.ndarray, hop_length: int = 1024, plot: bool = False, sr: int = 44100, ctx: SpectralContext = None) -> Dict:
     try:
-        zcr = librosa.feature.zero_crossing_rate(y, hop_length=hop_length)
+        if ctx is not None and ctx.hop_length == hop_length:
+            zcr = ctx.zero_crossing_rate()
+        else:
+            zcr = librosa.feature.zero_crossing_rate(signal_for(y, ctx), hop_length=hop_length)
         stats = extract_summary_statistics('zero_crossing', 1, zcr)
         if plot:
-            plot_feature(zcr, calculate_time_axis_for_frames(y, sr, hop_length), 'Zero Crossing Rate')
+            render_plot(plot_feature, zcr, librosa.times_like(zcr, sr=sr, hop_length=hop_length), 'Zero Crossing Rate')
         return stats
     except Exception as e:
+        raise_if_out_of_memory(e)
         print(f"Error in zero_crossing_rate: {e}")
         traceback.print_exc()
-        return {}
+        return ExtractionFailed()
 
-def chroma(y: np.ndarray, sr: int = 44100, hop_length: int = 1024, n_fft: int = 4096, plot: bool = False) -> Dict:
+def chroma(y: np.ndarray, sr: int = 44100, hop_length: int = 1024, n_fft: int = 4096, plot: bool = False, ctx: SpectralContext = None) -> Dict:
     try:
-        chr = librosa.feature.chroma_stft(y=y, sr=sr, hop_length=hop_length, n_fft=n_fft)
-        stats = {}
-        for i, chroma_band in enumerate(chr):
-            band_stats = extract_summary_statistics('chroma', i + 1, chroma_band)
-            stats.update(band_stats)
+        spec = spectral_context_for(y, sr, n_fft, hop_length, ctx)
+        chr = librosa.feature.chroma_stft(S=spec.power, sr=sr, hop_length=hop_length, n_fft=n_fft)
+        stats = extract_band_statistics('chroma', chr)
         if plot:
             # for i, chroma_band in enumerate(chr):
             #     plot_feature(chroma_band, calculate_time_axis_for_frames(y, sr, hop_length), f'Chroma {i + 1}')
-            plot_chroma(chr, sr, hop_length)
+            render_plot(plot_chroma, chr, sr, hop_length)
         return stats
     except Exception as e:
+        raise_if_out_of_memory(e)
         print(f"Error in chroma: {e}")
         traceback.print_exc()
-        return {}
+        return ExtractionFailed()
 
-def spectral_contrast(y: np.ndarray, sr: int = 44100, hop_length: int = 1024, n_fft: int = 4096, plot: bool = False) -> Dict:
+def spectral_contrast(y: np.ndarray, sr: int = 44100, hop_length: int = 1024, n_fft: int = 4096, plot: bool = False, ctx: SpectralContext = None) -> Dict:
     try:
-        contrast = librosa.feature.spectral_contrast(y=y, sr=sr, hop_length=hop_length, n_fft=n_fft)
-        stats = {}
-        for i, contrast_band in enumerate(contrast):
-            band_stats = extract_summary_statistics('spectral_contrast', i + 1, contrast_band)
-            stats.update(band_stats)
+        spec = spectral_context_for(y, sr, n_fft, hop_length, ctx)
+        contrast = librosa.feature.spectral_contrast(S=spec.magnitude, sr=sr, hop_length=hop_length, n_fft=n_fft)
+        stats = extract_band_statistics('spectral_contrast', contrast)
         if plot:
             # for i, contrast_band in enumerate(contrast):
             #     plot_feature(contrast_band, calculate_time_axis_for_frames(y, sr, hop_length), f'Spectral Contrast {i + 1}')
-            plot_spectral_contrast(contrast, sr, hop_length)
+            render_plot(plot_spectral_contrast, contrast, sr, hop_length)
         return stats
     except Exception as e:
+        raise_if_out_of_memory(e)
         print(f"Error in spectral_contrast: {e}")
         traceback.print_exc()
-        return {}
+        return ExtractionFailed()
 
-def rms(y: np.ndarray, hop_length: int = 1024, frame_length: int = 4096, plot: bool = False) -> Dict:
+def rms(y: np.ndarray, hop_length: int = 1024, frame_length: int = 4096, plot: bool = False, sr: int = 44100, ctx: SpectralContext = None) -> Dict:
     try:
-        rms_feature = librosa.feature.rms(y=y, hop_length=hop_length, frame_length=frame_length)
+        if ctx is not None and ctx.hop_length == hop_length:
+            rms_feature = ctx.rms(frame_length)
+        else:
+            rms_feature = librosa.feature.rms(y=signal_for(y, ctx), hop_length=hop_length, frame_length=frame_length)
         stats = extract_summary_statistics('RMS Energy', 1, rms_feature)
         if plot:
-            plot_feature(rms_feature, calculate_time_axis_for_frames(y, sr, hop_length), 'RMS Energy')
+            render_plot(plot_feature, rms_feature, librosa.times_like(rms_feature, sr=sr, hop_length=hop_length), 'RMS Energy')
         return stats
     except Exception as e:
+        raise_if_out_of_memory(e)
         print(f"Error in rms: {e}")
         traceback.print_exc()
-        return {}
+        return ExtractionFailed()
 
-def plot_feature(feature: np.ndarray, time_axis: np.ndarray, feature_name: str):
+def plot_feature(feature: np.ndarray, time_axis: np.ndarray, feature_name: str, output_path: str = None):
     try:
+        import matplotlib.pyplot as plt
         if feature.ndim == 2:
             feature = feature[0]  # In case feature is 2D, take the first row (common in librosa)
         plt.figure(figsize=(8, 2))
@@ -132,32 +150,37 @@ def plot_feature(feature: np.ndarray, time_axis: np.ndarray, feature_name: str):
         plt.xlabel('Time (s)')
         plt.ylabel('Feature Value')
         plt.title(f'{feature_name} Over Time')
-        plt.show()
-        plt.close()  # Close the figure to free up memory
+        finish_figure(plt, output_path)  # Closes the figure to free up memory
     except Exception as e:
         print(f"Error in plot_feature: {e}")
         traceback.print_exc()
 
-def plot_mfcc(mfcc: np.ndarray, sr: int, hop_length: int):
+def plot_mfcc(mfcc: np.ndarray, sr: int, hop_length: int, output_path: str = None):
+    import matplotlib.pyplot as plt
+    import librosa.display
     plt.figure(figsize=(8, 2))
     librosa.display.specshow(mfcc, sr=sr, hop_length=hop_length, x_axis='time', cmap='coolwarm')
     plt.colorbar(label='MFCC')
     plt.title('MFCC Over Time')
-    plt.show()
+    finish_figure(plt, output_path)
 
-def plot_chroma(chroma: np.ndarray, sr: int, hop_length: int):
+def plot_chroma(chroma: np.ndarray, sr: int, hop_length: int, output_path: str = None):
+    import matplotlib.pyplot as plt
+    import librosa.display
     plt.figure(figsize=(8, 2))
     librosa.display.specshow(chroma, sr=sr, hop_length=hop_length, x_axis='time', y_axis='chroma', cmap='coolwarm')
     plt.colorbar(label='Chroma')
     plt.title('Chroma Over Time')
-    plt.show()
+    finish_figure(plt, output_path)
 
-def plot_spectral_contrast(contrast: np.ndarray, sr: int, hop_length: int):
+def plot_spectral_contrast(contrast: np.ndarray, sr: int, hop_length: int, output_path: str = None):
+    import matplotlib.pyplot as plt
+    import librosa.display
     plt.figure(figsize=(8, 2))
     librosa.display.specshow(contrast, sr=sr, hop_length=hop_length, x_axis='time', y_axis='log', cmap='coolwarm')
     plt.colorbar(label='Spectral Contrast')
     plt.title('Spectral Contrast Over Time')
-    plt.show()
+    finish_figure(plt, output_path)
 
 if __name__ == "__main__":
     try:
@@ -167,28 +190,29 @@ if __name__ == "__main__":
         win_length = 4096
         n_fft = 4096
 
-        y = load_audio_mono(audio_path, sr)
+        y = load_audio_mono(audio_path, sr=sr)
         time_axis = calculate_time_axis(y, sr)
+        ctx = SpectralContext(y, sr, n_fft, hop_length)
 
-        bw_stats = bandwidth(y, sr, hop_length, n_fft, plot=True)
+        bw_stats = bandwidth(y, sr, hop_length, n_fft, plot=True, ctx=ctx)
         print(f"Bandwidth stats: {bw_stats}")
 
-        fl_stats = flatness(y, hop_length, n_fft, plot=True)
+        fl_stats = flatness(y, hop_length, n_fft, plot=True, ctx=ctx)
         print(f"Flatness stats: {fl_stats}")
 
-        cent_stats = centroid(y, sr, hop_length, n_fft, plot=True)
+        cent_stats = centroid(y, sr, hop_length, n_fft, plot=True, ctx=ctx)
         print(f"Centroid stats: {cent_stats}")
 
-        mfcc_stats = mfcc(y, sr, hop_length, n_fft, win_length, plot=True)
+        mfcc_stats = mfcc(y, sr, hop_length, n_fft, win_length, plot=True, ctx=ctx)
         print(f"MFCC stats: {mfcc_stats}")
 
         zcr_stats = zero_crossing_rate(y, hop_length, plot=True)
         print(f"Zero Crossing Rate stats: {zcr_stats}")
 
-        chroma_stats = chroma(y, sr, hop_length, n_fft, plot=True)
+        chroma_stats = chroma(y, sr, hop_length, n_fft, plot=True, ctx=ctx)
         print(f"Chroma stats: {chroma_stats}")
 
-        contrast_stats = spectral_contrast(y, sr, hop_length, n_fft, plot=True)
+        contrast_stats = spectral_contrast(y, sr, hop_length, n_fft, plot=True, ctx=ctx)
         print(f"Spectral Contrast stats: {contrast_stats}")
 
         rms_stats = rms(y, hop_length, win_length, plot=True)
@@ -1,43 +1,71 @@
 import numpy as np
 import pyloudnorm as pyln
-import matplotlib.pyplot as plt
 import traceback
 from typing import Dict
-from utility_functions import load_audio_stereo, extract_summary_statistics
+from utility_functions import load_audio_stereo, extract_summary_statistics, ExtractionFailed, raise_if_out_of_memory
+from plotting import render_plot, finish_figure
 
-def analyze_loudness(data: np.ndarray, sr: int = 44100, block_size: float = 0.4, plot_graph: bool = False) -> Dict:
-    if data is None:
-        return {}
+CHANNEL_GAINS = [1.0, 1.0, 1.0, 1.41, 1.41]
+ABSOLUTE_GATE = -70.0
+
+def block_loudness(data: np.ndarray, sr: int = 44100, block_size: float = 0.4) -> np.ndarray:
+    """ Loudness in LUFS of each consecutive, non-overlapping block of a (samples, channels) signal.
+
+    Equivalent to calling pyln.Meter.integrated_loudness on every full block,
+    but the K-weighting filters run once over all blocks (each block still
+    starts from a zero filter state) and the block energies are reduced
+    together. Blocks at or below the absolute gate come back as -inf, as the
+    meter reports them.
+    """
+    if data.ndim == 1:
+        data = data[:, np.newaxis]
+
+    block_samples = int(block_size * sr)
+    num_blocks = len(data) // block_samples
+    num_channels = data.shape[1]
+    if num_blocks == 0:
+        return np.array([])
+
+    meter = pyln.Meter(sr, block_size=block_size)
+    blocks = data[:num_blocks * block_samples].T.reshape(num_channels, num_blocks, block_samples)
+    for filter_stage in meter._filters.values():
+        # Like the meter, keep each stage's output in the input's dtype
+        blocks = filter_stage.apply_filter(blocks).astype(data.dtype, copy=False)
+
+    energy = (1.0 / (block_size * sr)) * np.sum(np.square(blocks[:, :, :block_samples]), axis=-1)
+    weighted = np.sum(np.array(CHANNEL_GAINS[:num_channels])[:, np.newaxis] * energy, axis=0)
+
+    with np.errstate(divide='ignore'):
+        loudness = -0.691 + 10.0 * np.log10(weighted)
+    loudness[loudness <= ABSOLUTE_GATE] = float('-inf')
+    return loudness
+
+def analyze_loudness(data: np.ndarray, sr: int = 44100, block_size: float = 0.4, plot_graph: bool = False, loudness: np.ndarray = None) -> Dict:
+    """ Summarise per-block loudness; pass precomputed block_loudness output as loudness to skip the DSP. """
+    if data is None and loudness is None:
+        return ExtractionFailed()
 
     try:
-        block_samples = int(block_size * sr)
-        meter = pyln.Meter(sr, block_size=block_size)
-        
-        segment_loudness = []
-        for start in range(0, len(data), block_samples):
-            end = start + block_samples
-            segment = data[start:end]
-            if len(segment) == block_samples:
-                loudness = meter.integrated_loudness(segment)
-                if loudness != float('-inf'):
-                    segment_loudness.append(loudness)
-
-        segment_loudness = np.array(segment_loudness)
+        if loudness is None:
+            loudness = block_loudness(data, sr, block_size)
+        segment_loudness = loudness[loudness != float('-inf')]
         summary_stats = extract_summary_statistics('loudness', 1, segment_loudness)
 
         if plot_graph:
             num_segments = len(segment_loudness)
-        plot_loudness_over_time(segment_loudness, block_size, sr, num_segments)
+            render_plot(plot_loudness_over_time, segment_loudness, block_size, sr, num_segments)
 
         return summary_stats
 
     except Exception as e:
+        raise_if_out_of_memory(e)
         print(f"Error in analyze_loudness: {e}")
         traceback.print_exc()
-        return {}
+        return ExtractionFailed()
 
-def plot_loudness_over_time(segment_loudness: np.ndarray, block_size: float, sr: int, num_segments: int):
+def plot_loudness_over_time(segment_loudness: np.ndarray, block_size: float, sr: int, num_segments: int, output_path: str = None):
     try:
+        import matplotlib.pyplot as plt
         # Correctly calculate the time axis based on the number of segments
         time_axis = np.arange(0, num_segments * block_size, block_size)
         plt.figure(figsize=(8, 2))
@@ -45,7 +73,7 @@ def plot_loudness_over_time(segment_loudness: np.ndarray, block_size: float, sr:
         plt.xlabel('Time (s)')
         plt.ylabel('Loudness (LUFS)')
         plt.title('Perceived Loudness Over Time')
-        plt.show()
+        finish_figure(plt, output_path)
 
     except Exception as e:
         print(f"Error in plot_loudness_over_time: {e}")
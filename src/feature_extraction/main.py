@@ -1,97 +1,305 @@
 import os
+import json
+import argparse
 import pandas as pd
+import pyarrow.parquet as pq
+import soundfile as sf
 import traceback
 
-from loudness import analyze_loudness
-from librosa_features import bandwidth, centroid, flatness, mfcc, zero_crossing_rate, chroma, spectral_contrast, rms
-from tempo import plp
-from utility_functions import load_audio_mono, load_audio_stereo
+from streaming import stream_features, streamed_definitions
+from feature_registry import Track
+from utility_functions import ExtractionFailed, raise_if_out_of_memory
+from features import registry, use_profile, extraction_params, cached_arrays, PROFILES, DEFAULT_PROFILE
+from feature_store import (FeatureWriter, list_parts, load_done, export_csv, record_quarantine, load_quarantine, migrate_csv,
+                           rename_legacy_sidecars, fingerprint_column, read_fingerprints, stamp_fingerprints)
+from array_cache import ArrayCache
+from audio_store import AUDIO_STORE_ENV
+from worker_pool import SupervisedPool, TASK_OK
+from sharding import in_shard, shard_output_path
+from instrumentation import Instrumentation, use_instrumentation, stage, report, print_report
+from plotting import DeferredRenderer, use_renderer, PLOT_MODES, PLOTS_NONE, PLOTS_SHOW, PLOTS_DEFERRED
 
-def load_cache(output_csv_path=None):
-    if output_csv_path and os.path.exists(output_csv_path):
-        df = pd.read_csv(output_csv_path)
-        return {row['isrc']: True for _, row in df.iterrows()}
-    return {}
+AUDIO_DIRECTORY = "/Volumes/Samsung T7/tracks"
+PARALLEL_CHUNK_SIZE = 256
+STREAM_ABOVE_SECONDS = 1200
 
-def process_audio_file(audio_path, tempo, isrc):
+def load_cache(output_path=None, skip_quarantined=True):
+    if not output_path:
+        return set()
+    if os.path.isdir(output_path):
+        rename_legacy_sidecars(output_path)
+    # Quarantined tracks failed before; they are skipped like finished ones
+    skipped = set(load_quarantine(output_path)) if skip_quarantined else set()
+    if not os.path.isdir(output_path):
+        return skipped
+    return load_done(output_path) | skipped
+
+def stale_features(output_path, processed_cache):
+    """ Map each finished ISRC whose stored fingerprints are missing or outdated to the features to recompute.
+
+    Those ISRCs are removed from processed_cache so they are picked up again.
+    """
+    if not output_path or not os.path.isdir(output_path):
+        return {}
+    fingerprints = read_fingerprints(output_path)
+    fingerprints = fingerprints[fingerprints.index.isin(processed_cache)]
+    stale = {}
+    for name in registry.features:
+        column = fingerprint_column(name)
+        if column in fingerprints.columns:
+            current = fingerprints[column] == registry.fingerprint(name)
+        else:
+            current = pd.Series(False, index=fingerprints.index)
+        for isrc in fingerprints.index[~current]:
+            stale.setdefault(isrc, []).append(name)
+    processed_cache.difference_update(stale)
+    return stale
+
+def column_feature(column):
+    """ The registered feature a stored column belongs to, or None. """
+    for name in registry.features:
+        if column == fingerprint_column(name) or column.startswith(f'{name}_'):
+            return name
+    return None
+
+def previous_rows(output_path, stale):
+    """ The still-current columns of each stale ISRC's stored row, by ISRC, which recomputed features are merged into.
+
+    Parts are read one at a time, with only the rows of stale ISRCs and the
+    columns of features that are not being recomputed.
+    """
+    if not stale:
+        return {}
+    current = {isrc: {name for name in registry.features if name not in names} for isrc, names in stale.items()}
+    wanted = set().union(*current.values())
+    rows = {}
+    for part in list_parts(output_path):
+        columns = [column for column in pq.read_schema(part).names if column_feature(column) in wanted]
+        df = pd.read_parquet(part, columns=['isrc'] + columns, filters=[('isrc', 'in', list(stale))])
+        # Later parts win, as in read_features
+        for row in df.to_dict('records'):
+            isrc = str(row.pop('isrc'))
+            rows[isrc] = {column: value for column, value in row.items() if column_feature(column) in current[isrc]}
+    return rows
+
+def process_audio_file(audio_path, tempo, isrc, plot_mode=PLOTS_SHOW, renderer=None, cache=None, stream_above=STREAM_ABOVE_SECONDS,
+                       metrics=None, features=None, profile=DEFAULT_PROFILE):
+    use_instrumentation(metrics)
+    use_profile(profile)
+    if metrics is not None:
+        metrics.start_track(isrc)
+    result = extract_track(audio_path, tempo, isrc, plot_mode, renderer, cache, stream_above, features)
+    if metrics is not None:
+        metrics.finish_track('ok' if result else 'error')
+    return result
+
+def extract_track(audio_path, tempo, isrc, plot_mode=PLOTS_SHOW, renderer=None, cache=None, stream_above=STREAM_ABOVE_SECONDS, features=None):
+    """ Extract the named registered features of one track (all of them by default), each with its fingerprint column. """
+    plot = plot_mode == PLOTS_SHOW or (plot_mode == PLOTS_DEFERRED and renderer.wants(isrc))
+    use_renderer(renderer if plot_mode == PLOTS_DEFERRED else None, isrc)
+    features = [name for name in registry.features if features is None or name in features]
     try:
-        mono_audio_not_trimmed = load_audio_mono(audio_path, False)
-        mono_audio = load_audio_mono(audio_path)
-        stereo_audio = load_audio_stereo(audio_path)
-
-        # Extract features and their summary statistics
-        pulse_summary_stats = plp(mono_audio_not_trimmed, audio_path, tempo, plot_graph=True, save_audio_with_clicks=False, save_plp=False)
-        loudness_summary_stats = analyze_loudness(stereo_audio, plot_graph=True)
-        centroid_summary_stats = centroid(mono_audio, plot=True)
-        bandwidth_summary_stats = bandwidth(mono_audio, plot=True)
-        flatness_summary_stats = flatness(mono_audio, plot=True)
-        mfcc_features = mfcc(mono_audio, plot=True)
-        zcr_summary_stats = zero_crossing_rate(mono_audio, plot=True)
-        chroma_features = chroma(mono_audio, plot=True)
-        contrast_features = spectral_contrast(mono_audio, plot=True)
-        rms_summary_stats = rms(mono_audio, plot=True)
-
-        # Initialize result dictionary with ISRC
-        result = {'isrc': isrc}
+        if stream_above is not None and sf.info(audio_path).duration > stream_above:
+            # Too long to decode whole: extract block by block in bounded memory, without plots
+            with stage('stream'):
+                streamed = stream_features(audio_path, tempo, **extraction_params())
+            if not streamed:
+                return None
+            # Only features streamed with their registered definition are current; the rest are recomputed when possible
+            definitions = streamed_definitions(**extraction_params())
+            produced = {column_feature(column) for column in streamed}
+            return {'isrc': isrc, **streamed, **{fingerprint_column(name): registry.fingerprint(name) for name in registry.features
+                                                 if name in produced and definitions.get(name) == registry.params(name)}}
 
-        # Use update() to flatten and merge dictionaries
-        result.update(pulse_summary_stats)
-        result.update(loudness_summary_stats)
-        result.update(centroid_summary_stats)
-        result.update(bandwidth_summary_stats)
-        result.update(flatness_summary_stats)
-        result.update(zcr_summary_stats)
-        result.update(rms_summary_stats)
-        result.update(mfcc_features)
-        result.update(chroma_features)
-        result.update(contrast_features)
+        track_cache = cache.track(audio_path, **extraction_params()) if cache is not None else None
+        # Decode up front so an unreadable file fails the whole track, unless nothing needs decoding
+        eager = ['audio'] if track_cache is None or not track_cache.has_all(cached_arrays()) else []
+        outputs = registry.run(features, Track(audio_path, tempo, isrc, plot, track_cache), eager)
+
+        result = {'isrc': isrc}
+        fingerprints = {}
+        for name, summary_stats in outputs.items():
+            result.update(summary_stats)
+            # A feature that failed gets no fingerprint, so the next run retries it; an empty result is current
+            if not isinstance(summary_stats, ExtractionFailed):
+                fingerprints[fingerprint_column(name)] = registry.fingerprint(name)
+        result.update(fingerprints)
         return result
 
     except Exception as e:
+        # The worker pool reports it as an exhausted memory budget and replaces the worker
+        raise_if_out_of_memory(e)
         print(f"Error processing {audio_path}: {e}")
         traceback.print_exc()
         return None
 
-def append_to_csv(output_csv_path, data):
-    df = pd.DataFrame([data])
-    if not os.path.isfile(output_csv_path):
-        df.to_csv(output_csv_path, index=False, mode='w')
-    else:
-        df.to_csv(output_csv_path, index=False, mode='a', header=False)
-
-def process_csv(csv_path, output_csv_path):
-    processed_cache = load_cache(output_csv_path)
+def process_csv(csv_path, output_path, workers=1, audio_directory=AUDIO_DIRECTORY, flush_rows=256, flush_seconds=60.0,
+                plot_mode=PLOTS_SHOW, renderer=None, cache=None, stream_above=STREAM_ABOVE_SECONDS, metrics=None,
+                shard=None, track_timeout=None, memory_limit_mb=None, retry_quarantined=False, profile=DEFAULT_PROFILE):
+    if os.path.isfile(output_path):
+        print(f"Output {output_path} is a file, but features are written to a directory of Parquet parts; "
+              f"migrate it with feature_store.migrate_csv or pass a directory.")
+        return
+    # Fingerprints, and so what counts as outdated, depend on the profile
+    use_profile(profile)
+    processed_cache = load_cache(output_path, skip_quarantined=not retry_quarantined)
+    stale = stale_features(output_path, processed_cache)
+    previous = previous_rows(output_path, stale)
+    if stale:
+        print(f"Recomputing outdated features of {len(stale)} tracks")
+    # Part file writes happen in this process, also when tracks run in a pool
+    use_instrumentation(metrics)
 
     if not os.path.exists(csv_path):
         print(f"Input CSV file {csv_path} does not exist.")
         return
 
+    def quarantine(isrc, reason):
+        print(f"Quarantining {isrc}: {reason}")
+        record_quarantine(output_path, isrc, reason)
+
     try:
-        with open(csv_path, 'r') as f:
-            reader = pd.read_csv(f, chunksize=1)
-            for chunk in reader:
-                for row in process_rows(chunk, processed_cache):
-                    append_to_csv(output_csv_path, row)
+        with open(csv_path, 'r') as f, FeatureWriter(output_path, flush_rows, flush_seconds) as writer:
+            if workers > 1 or track_timeout is not None or memory_limit_mb is not None:
+                reader = pd.read_csv(f, chunksize=PARALLEL_CHUNK_SIZE)
+                tracks = (track for chunk in reader for track in pending_tracks(chunk, processed_cache, audio_directory, shard, stale))
+                for row in process_tracks_parallel(tracks, processed_cache, workers, plot_mode, renderer, cache, stream_above, metrics,
+                                                   track_timeout, memory_limit_mb, quarantine, profile):
+                    writer.write({**previous.get(row['isrc'], {}), **row})
+            else:
+                reader = pd.read_csv(f, chunksize=1)
+                for chunk in reader:
+                    for row in process_rows(chunk, processed_cache, audio_directory, plot_mode, renderer, cache, stream_above, metrics, shard,
+                                            quarantine, stale, profile):
+                        writer.write({**previous.get(row['isrc'], {}), **row})
     except pd.errors.EmptyDataError:
         print(f"Input CSV file {csv_path} is empty.")
         return
 
-def process_rows(df, processed_cache):
+def pending_tracks(df, processed_cache, audio_directory=AUDIO_DIRECTORY, shard=None, stale=None):
+    """ Yield (audio_path, tempo, isrc, features) for each track still to do; features is None for all of them. """
     for _, row in df.iterrows():
         isrc = str(row['isrc'])
         tempo = row['tempo']
-        audio_path = "/Volumes/Samsung T7/tracks/" + isrc + ".wav"
-        print(f'Processing audio {isrc}')
-        if not os.path.exists(audio_path):
+        audio_path = os.path.join(audio_directory, isrc + ".wav")
+        if isrc in processed_cache or not in_shard(isrc, shard):
             continue
 
-        if isrc in processed_cache:
+        if not os.path.exists(audio_path):
             continue
 
-        result = process_audio_file(audio_path, tempo, isrc)
+        yield audio_path, tempo, isrc, stale.get(isrc) if stale else None
+
+def process_rows(df, processed_cache, audio_directory=AUDIO_DIRECTORY, plot_mode=PLOTS_SHOW, renderer=None, cache=None,
+                 stream_above=STREAM_ABOVE_SECONDS, metrics=None, shard=None, on_failure=None, stale=None, profile=DEFAULT_PROFILE):
+    for audio_path, tempo, isrc, features in pending_tracks(df, processed_cache, audio_directory, shard, stale):
+        print(f'Processing audio {isrc}')
+        result = process_audio_file(audio_path, tempo, isrc, plot_mode, renderer, cache, stream_above, metrics, features, profile)
         if result:
-           processed_cache[isrc] = True
+           processed_cache.add(isrc)
            yield result
+        elif on_failure is not None:
+            on_failure(isrc, 'extraction failed')
+
+def process_tracks_parallel(tracks, processed_cache, workers, plot_mode=PLOTS_NONE, renderer=None, cache=None,
+                            stream_above=STREAM_ABOVE_SECONDS, metrics=None, track_timeout=None, memory_limit_mb=None, on_failure=None,
+                            profile=DEFAULT_PROFILE):
+    """ Fan tracks out over supervised worker processes and yield results as they finish.
+
+    A track is only handed out when a worker is free, so the input is
+    consumed lazily and memory stays flat regardless of catalog size. Tracks
+    that time out, exhaust the memory budget, crash their worker or fail
+    are passed to on_failure with the reason.
+    """
+    pool = SupervisedPool(workers, process_audio_file, track_timeout, memory_limit_mb)
+    tasks = ((isrc, (audio_path, tempo, isrc, plot_mode, renderer, cache, stream_above, metrics, features, profile))
+             for audio_path, tempo, isrc, features in tracks)
+    for isrc, status, value in pool.run(announce(tasks)):
+        if status == TASK_OK and value:
+            processed_cache.add(isrc)
+            yield value
+        elif on_failure is not None:
+            on_failure(isrc, value if status != TASK_OK else 'extraction failed')
+
+def announce(tasks):
+    for isrc, args in tasks:
+        print(f'Processing audio {isrc}')
+        yield isrc, args
 
 if __name__ == "__main__":
-    process_csv("survey.csv", "survey_result.csv")
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Extract audio features for every track in a CSV.")
+    parser.add_argument("input_csv", nargs="?", default="survey.csv")
+    parser.add_argument("output", nargs="?", default="survey_result.parquet", help="Directory of Parquet parts")
+    parser.add_argument("--workers", type=int, default=1, help="Number of worker processes (1 runs in-process)")
+    parser.add_argument("--audio-dir", default=AUDIO_DIRECTORY)
+    parser.add_argument("--flush-rows", type=int, default=256)
+    parser.add_argument("--flush-seconds", type=float, default=60.0)
+    parser.add_argument("--export-csv", default=None, help="Also write the finished feature table to this CSV")
+    parser.add_argument("--plots", choices=PLOT_MODES, default=PLOTS_SHOW,
+                        help="'none' never imports matplotlib, 'show' opens every figure, 'deferred' writes PNGs for a sample of tracks")
+    parser.add_argument("--plot-dir", default="diagnostic_plots")
+    parser.add_argument("--plot-sample", type=float, default=0.01, help="Fraction of tracks rendered in deferred mode")
+    parser.add_argument("--array-cache", default=None, help="Directory for cached intermediate arrays (disabled if omitted)")
+    parser.add_argument("--array-cache-gb", type=float, default=50.0, help="Size cap of the array cache")
+    parser.add_argument("--stream-above", type=float, default=STREAM_ABOVE_SECONDS,
+                        help="Tracks longer than this many seconds are extracted block by block in bounded memory")
+    parser.add_argument("--audio-store", default=None,
+                        help="Directory written by audio_store.py; ingested tracks are memory-mapped from it instead of decoded")
+    parser.add_argument("--metrics-log", default="extraction_metrics.jsonl",
+                        help="JSON-lines log of per-track stage timings; an empty string disables instrumentation")
+    parser.add_argument("--trace-allocations", action="store_true", help="Also measure allocation peaks per stage with tracemalloc (slow)")
+    parser.add_argument("--shards", type=int, default=None, help="Split the input into this many shards by ISRC hash")
+    parser.add_argument("--shard", type=int, default=0, help="Index of the shard this node processes, from 0")
+    parser.add_argument("--track-timeout", type=float, default=None,
+                        help="Seconds a track may take before its worker is killed and the track quarantined; "
+                             "with --workers 1, setting it runs tracks in a supervised subprocess")
+    parser.add_argument("--memory-budget-mb", type=float, default=None, help="Memory a worker may grow by before it is stopped and replaced")
+    parser.add_argument("--retry-quarantined", action="store_true", help="Process tracks that failed in earlier runs again")
+    parser.add_argument("--profile", choices=list(PROFILES), default=DEFAULT_PROFILE,
+                        help="'full' extracts at 44.1 kHz, 'fast' at 22.05 kHz with FFT sizes scaled to match; write each to its own output")
+    parser.add_argument("--stamp-fingerprints", action="store_true",
+                        help="Mark rows written before feature fingerprints existed as current instead of recomputing them")
+    args = parser.parse_args()
+
+    if args.audio_store:
+        # Set in the environment so pool workers read from the store too
+        os.environ[AUDIO_STORE_ENV] = args.audio_store
+
+    if os.path.isfile(args.output):
+        # A single CSV from before the Parquet output; carry on in a directory next to it
+        args.output = migrate_csv(args.output)
+
+    output_path = args.output
+    shard = None
+    if args.shards:
+        # Each shard writes its own partition of the output; sharding.py merges them
+        shard = (args.shard, args.shards)
+        output_path = shard_output_path(args.output, shard)
+
+    use_profile(args.profile)
+    if args.stamp_fingerprints and os.path.isdir(output_path):
+        stamp_fingerprints(output_path, {name: registry.fingerprint(name) for name in registry.features})
+
+    cache = ArrayCache(args.array_cache, int(args.array_cache_gb * 1024**3)) if args.array_cache else None
+
+    metrics = Instrumentation(args.metrics_log, args.trace_allocations) if args.metrics_log else None
+
+    renderer = None
+    if args.plots == PLOTS_DEFERRED:
+        renderer = DeferredRenderer(args.plot_dir, args.plot_sample)
+        renderer.start()
+    try:
+        process_csv(args.input_csv, output_path, workers=args.workers, audio_directory=args.audio_dir,
+                    flush_rows=args.flush_rows, flush_seconds=args.flush_seconds, plot_mode=args.plots, renderer=renderer, cache=cache,
+                    stream_above=args.stream_above, metrics=metrics, shard=shard, track_timeout=args.track_timeout or None,
+                    memory_limit_mb=args.memory_budget_mb, retry_quarantined=args.retry_quarantined, profile=args.profile)
+    finally:
+        if renderer is not None:
+            renderer.close()
+    if metrics is not None:
+        summary = report(args.metrics_log, metrics.run_id)
+        print_report(summary)
+        with open(os.path.splitext(args.metrics_log)[0] + '.report.json', 'w') as f:
+            json.dump(summary, f, indent=2)
+    if args.export_csv:
+        export_csv(output_path, args.export_csv)
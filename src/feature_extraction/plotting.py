@@ -0,0 +1,95 @@
+import os
+import zlib
+import traceback
+import multiprocessing
+
+PLOTS_NONE = 'none'
+PLOTS_SHOW = 'show'
+PLOTS_DEFERRED = 'deferred'
+PLOT_MODES = [PLOTS_NONE, PLOTS_SHOW, PLOTS_DEFERRED]
+
+_active_renderer = None
+_active_isrc = None
+_plot_index = 0
+
+
+class DeferredRenderer:
+    """ Writes diagnostic figures as PNGs from a background process.
+
+    Only a deterministic sample of tracks (by ISRC hash) is rendered, so the
+    same tracks are picked on every run. Figures are sent over a bounded
+    managed queue, which stays valid when the renderer is pickled into
+    extraction pool workers; all of them feed the single render process.
+    """
+
+    def __init__(self, output_dir, sample_fraction=0.01, queue_size=64):
+        self.output_dir = output_dir
+        self.sample_fraction = sample_fraction
+        self.queue_size = queue_size
+        self._queue = None
+        self._manager = None
+        self._process = None
+
+    def wants(self, isrc):
+        return zlib.crc32(str(isrc).encode()) % 10000 < self.sample_fraction * 10000
+
+    def start(self):
+        os.makedirs(self.output_dir, exist_ok=True)
+        self._manager = multiprocessing.Manager()
+        self._queue = self._manager.Queue(self.queue_size)
+        self._process = multiprocessing.Process(target=_render_loop, args=(self._queue,), daemon=True)
+        self._process.start()
+
+    def submit(self, plot_function, output_name, *args):
+        output_path = os.path.join(self.output_dir, f'{output_name}.png')
+        self._queue.put((plot_function, args, output_path))
+
+    def close(self):
+        if self._process is not None:
+            self._queue.put(None)
+            self._process.join()
+            self._manager.shutdown()
+            self._process = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_manager'] = None
+        state['_process'] = None
+        return state
+
+
+def _render_loop(queue):
+    import matplotlib
+    matplotlib.use('Agg')
+    while True:
+        job = queue.get()
+        if job is None:
+            return
+        plot_function, args, output_path = job
+        try:
+            plot_function(*args, output_path=output_path)
+        except Exception as e:
+            print(f"Error rendering {output_path}: {e}")
+            traceback.print_exc()
+
+def use_renderer(renderer, isrc=None):
+    """ Route the current track's plots to renderer; None draws them interactively. """
+    global _active_renderer, _active_isrc, _plot_index
+    _active_renderer = renderer
+    _active_isrc = isrc
+    _plot_index = 0
+
+def render_plot(plot_function, *args):
+    global _plot_index
+    if _active_renderer is None:
+        plot_function(*args)
+    else:
+        _plot_index += 1
+        _active_renderer.submit(plot_function, f'{_active_isrc}_{_plot_index:02d}_{plot_function.__name__}', *args)
+
+def finish_figure(plt, output_path=None):
+    if output_path:
+        plt.savefig(output_path)
+    else:
+        plt.show()
+    plt.close()
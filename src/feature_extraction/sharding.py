@@ -0,0 +1,87 @@
+import os
+import glob
+import zlib
+import shutil
+import argparse
+import pandas as pd
+from feature_store import read_features, write_part
+
+SHARD_PATTERN = 'shard-*-of-*'
+
+
+def shard_of(isrc, shard_count):
+    """ The shard an ISRC belongs to; stable across machines and Python versions. """
+    return zlib.crc32(str(isrc).encode()) % shard_count
+
+def in_shard(isrc, shard):
+    """ Whether isrc falls in shard, an (index, count) pair; None selects every track. """
+    return shard is None or shard_of(isrc, shard[1]) == shard[0]
+
+def shard_output_path(output_path, shard):
+    index, count = shard
+    return os.path.join(output_path, f'shard-{index:03d}-of-{count:03d}')
+
+def list_shards(output_path):
+    return sorted(glob.glob(os.path.join(output_path, SHARD_PATTERN)))
+
+def merge_shards(output_path, merged_path):
+    """ Combine every shard's parts into one table at merged_path, one row per ISRC.
+
+    Shards are read in name order and parts within a shard in part order.
+    An ISRC found more than once (e.g. after a rerun with a different shard
+    count) keeps the last row in that order: from the shard whose name sorts
+    last, which is not necessarily the one written last.
+    """
+    shards = [read_features(path) for path in list_shards(output_path)]
+    shards = [df for df in shards if len(df)]
+    if not shards:
+        return pd.DataFrame(columns=['isrc'])
+    merged = pd.concat(shards, ignore_index=True)
+    merged['isrc'] = merged['isrc'].astype(str)
+    merged = merged.drop_duplicates(subset='isrc', keep='last').reset_index(drop=True)
+
+    # Replace any earlier merge rather than layering parts on top of it
+    if os.path.exists(merged_path):
+        shutil.rmtree(merged_path)
+    os.makedirs(merged_path)
+    write_part(merged_path, merged)
+    return merged
+
+def check_coverage(merged, manifest_csv, audio_directory=None):
+    """ Compare merged ISRCs to the manifest's; lists what is missing and what is unexpected.
+
+    With audio_directory, missing tracks are split into those without an
+    audio file, which extraction skips by design, and those that failed.
+    """
+    manifest = set(pd.read_csv(manifest_csv, usecols=['isrc'])['isrc'].astype(str))
+    extracted = set(merged['isrc'])
+    missing = sorted(manifest - extracted)
+    coverage = {
+        'manifest': len(manifest),
+        'extracted': len(extracted & manifest),
+        'missing': missing,
+        'unexpected': sorted(extracted - manifest),
+    }
+    if audio_directory is not None:
+        coverage['missing_audio'] = [isrc for isrc in missing if not os.path.exists(os.path.join(audio_directory, isrc + '.wav'))]
+        coverage['failed'] = sorted(set(missing) - set(coverage['missing_audio']))
+    return coverage
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Merge per-shard feature outputs and check them against the manifest.")
+    parser.add_argument("output", help="Output directory the shards were written to (main.py --shards)")
+    parser.add_argument("manifest", help="The input CSV every shard was cut from")
+    parser.add_argument("--merged", default=None, help="Where to write the merged table (default: OUTPUT/merged)")
+    parser.add_argument("--audio-dir", default=None, help="Split missing tracks into missing audio and failed extraction")
+    parser.add_argument("--missing-list", default=None, help="Write the ISRCs missing from the merge to this file")
+    args = parser.parse_args()
+
+    merged = merge_shards(args.output, args.merged or os.path.join(args.output, 'merged'))
+    coverage = check_coverage(merged, args.manifest, args.audio_dir)
+    print(f"{coverage['extracted']} of {coverage['manifest']} manifest tracks extracted, "
+          f"{len(coverage['missing'])} missing, {len(coverage['unexpected'])} not in the manifest")
+    if args.audio_dir is not None:
+        print(f"Missing: {len(coverage['missing_audio'])} without an audio file, {len(coverage['failed'])} failed")
+    if args.missing_list:
+        with open(args.missing_list, 'w') as f:
+            f.writelines(f'{isrc}\n' for isrc in coverage['missing'])
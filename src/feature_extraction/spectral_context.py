@@ -0,0 +1,68 @@
+import numpy as np
+import librosa
+from functools import cached_property
+
+
+class SpectralContext:
+    """ Per-track spectrogram cache shared by the spectral extractors.
+
+    The STFT, power spectrum and mel spectrogram are computed on first access
+    and reused, so each track is transformed once instead of once per feature.
+    y may be a zero-argument callable, in which case the signal is only
+    loaded if something has to be computed from it. With a TrackCache, frame
+    level arrays are read from and written to the on-disk array cache.
+    """
+
+    def __init__(self, y, sr: int = 44100, n_fft: int = 4096, hop_length: int = 1024, cache=None):
+        self._y = y
+        self.sr = sr
+        self.n_fft = n_fft
+        self.hop_length = hop_length
+        self.cache = cache
+
+    @cached_property
+    def y(self) -> np.ndarray:
+        return self._y() if callable(self._y) else self._y
+
+    def matches(self, sr: int, n_fft: int, hop_length: int) -> bool:
+        return self.sr == sr and self.n_fft == n_fft and self.hop_length == hop_length
+
+    def _cached(self, name, compute):
+        if self.cache is None:
+            return compute()
+        return self.cache.get(name, compute)
+
+    @cached_property
+    def magnitude(self) -> np.ndarray:
+        return self._cached('magnitude', lambda: np.abs(librosa.stft(y=self.y, n_fft=self.n_fft, hop_length=self.hop_length)))
+
+    @cached_property
+    def power(self) -> np.ndarray:
+        return self.magnitude ** 2
+
+    @cached_property
+    def mel(self) -> np.ndarray:
+        return self._cached('mel', lambda: librosa.feature.melspectrogram(S=self.power, sr=self.sr, n_fft=self.n_fft, hop_length=self.hop_length))
+
+    @cached_property
+    def log_mel(self) -> np.ndarray:
+        return librosa.power_to_db(self.mel)
+
+    def rms(self, frame_length: int) -> np.ndarray:
+        return self._cached(f'rms_{frame_length}', lambda: librosa.feature.rms(y=self.y, hop_length=self.hop_length, frame_length=frame_length))
+
+    def zero_crossing_rate(self) -> np.ndarray:
+        return self._cached('zero_crossing_rate', lambda: librosa.feature.zero_crossing_rate(self.y, hop_length=self.hop_length))
+
+
+def spectral_context_for(y: np.ndarray, sr: int, n_fft: int, hop_length: int, ctx: SpectralContext = None) -> SpectralContext:
+    """ Reuse ctx when it was built with the same parameters, otherwise build a fresh one. """
+    if ctx is not None and ctx.matches(sr, n_fft, hop_length):
+        return ctx
+    return SpectralContext(signal_for(y, ctx), sr, n_fft, hop_length)
+
+def signal_for(y: np.ndarray, ctx: SpectralContext = None) -> np.ndarray:
+    """ The signal passed to an extractor, falling back to the context's when y is None. """
+    if y is None and ctx is not None:
+        return ctx.y
+    return y
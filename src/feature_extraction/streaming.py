@@ -0,0 +1,609 @@
+import numpy as np
+import librosa
+import soundfile as sf
+import soxr
+import traceback
+from typing import Dict
+from loudness import block_loudness
+from utility_functions import SUMMARY_STATISTICS, raise_if_out_of_memory
+
+READ_BLOCK_SAMPLES = 1 << 16
+# Frames kept per band for quantiles: exact up to about six minutes at a 1024 hop
+SKETCH_CAPACITY = 16384
+# librosa.effects.trim's framing, which the in-memory views are trimmed with at every sample rate
+TRIM_FRAME_LENGTH = 2048
+TRIM_HOP_LENGTH = 512
+TRIM_AMIN = 1e-5
+# librosa.power_to_db's default floor below the loudest value, which MFCC, spectral contrast and onsets use
+TOP_DB = 80.0
+# How far stream_features may be from process_audio_file: means, moments and extremes within
+# rtol or atol (both sum float32 frames, in different orders), and quantiles within
+# quantile_iqr of the band's interquartile range, for the sketch
+STREAM_TOLERANCE = {'rtol': 1e-3, 'atol': 1e-3, 'quantile_iqr': 0.03}
+QUANTILE_STATISTICS = ('median', 'q1', 'q3', 'iqr')
+
+
+class QuantileSketch:
+    """ Mergeable fixed-size uniform reservoir of frames, sampled jointly for all bands. """
+
+    def __init__(self, bands, capacity=SKETCH_CAPACITY, seed=0):
+        self.capacity = capacity
+        self.sample = np.empty((bands, capacity))
+        self.filled = 0
+        self.count = 0
+        self.rng = np.random.default_rng(seed)
+
+    def update(self, frames):
+        n = frames.shape[1]
+        fill = min(self.capacity - self.filled, n)
+        if fill > 0:
+            self.sample[:, self.filled:self.filled + fill] = frames[:, :fill]
+            self.filled += fill
+
+        if fill < n:
+            # Algorithm R: item t replaces a random slot with probability capacity / (t + 1)
+            seen = self.count + fill + np.arange(n - fill)
+            slots = self.rng.integers(0, seen + 1)
+            keep = slots < self.capacity
+            self.sample[:, slots[keep]] = frames[:, fill:][:, keep]
+        self.count += n
+
+    def merge(self, other):
+        if other.count == 0:
+            return
+        if self.count == 0:
+            self.sample, self.filled, self.count = other.sample.copy(), other.filled, other.count
+            return
+
+        total = self.count + other.count
+        if self.filled + other.filled <= self.capacity:
+            sample = np.concatenate([self.sample[:, :self.filled], other.sample[:, :other.filled]], axis=1)
+        else:
+            from_self = min(self.rng.binomial(self.capacity, self.count / total), self.filled)
+            from_other = min(self.capacity - from_self, other.filled)
+            sample = np.concatenate([
+                self.sample[:, self.rng.choice(self.filled, from_self, replace=False)],
+                other.sample[:, self.rng.choice(other.filled, from_other, replace=False)],
+            ], axis=1)
+        self.filled = sample.shape[1]
+        self.sample = np.empty((sample.shape[0], self.capacity))
+        self.sample[:, :self.filled] = sample
+        self.count = total
+
+    def quantiles(self, q):
+        return np.percentile(self.sample[:, :self.filled], q, axis=1)
+
+
+class RunningStats:
+    """ Mergeable per-band summary statistics over frames seen in blocks.
+
+    Mean and the central moments up to the fourth are folded in with the
+    pairwise update of Pebay (2008); quantiles come from a QuantileSketch.
+    summary() yields the same columns as extract_band_statistics.
+    """
+
+    def __init__(self, bands, sketch_capacity=SKETCH_CAPACITY):
+        self.n = 0
+        self.mean = np.zeros(bands)
+        self.m2 = np.zeros(bands)
+        self.m3 = np.zeros(bands)
+        self.m4 = np.zeros(bands)
+        self.min = np.full(bands, np.inf)
+        self.max = np.full(bands, -np.inf)
+        self.sketch = QuantileSketch(bands, sketch_capacity)
+
+    def update(self, frames):
+        frames = np.atleast_2d(np.asarray(frames, dtype=np.float64))
+        if frames.shape[1] == 0:
+            return
+        block = RunningStats(frames.shape[0], 0)
+        block.n = frames.shape[1]
+        block.mean = frames.mean(axis=1)
+        deviation = frames - block.mean[:, np.newaxis]
+        squared = deviation * deviation
+        block.m2 = squared.sum(axis=1)
+        block.m3 = (squared * deviation).sum(axis=1)
+        block.m4 = (squared * squared).sum(axis=1)
+        block.min = frames.min(axis=1)
+        block.max = frames.max(axis=1)
+        self._merge_moments(block)
+        self.sketch.update(frames)
+
+    def merge(self, other):
+        self._merge_moments(other)
+        self.sketch.merge(other.sketch)
+
+    def _merge_moments(self, other):
+        if other.n == 0:
+            return
+        na, nb = self.n, other.n
+        n = na + nb
+        delta = other.mean - self.mean
+        m2 = self.m2 + other.m2 + delta**2 * na * nb / n
+        m3 = (self.m3 + other.m3 + delta**3 * na * nb * (na - nb) / n**2
+              + 3 * delta * (na * other.m2 - nb * self.m2) / n)
+        m4 = (self.m4 + other.m4 + delta**4 * na * nb * (na**2 - na * nb + nb**2) / n**3
+              + 6 * delta**2 * (na**2 * other.m2 + nb**2 * self.m2) / n**2
+              + 4 * delta * (na * other.m3 - nb * self.m3) / n)
+        self.mean = self.mean + delta * nb / n
+        self.m2, self.m3, self.m4 = m2, m3, m4
+        self.min = np.minimum(self.min, other.min)
+        self.max = np.maximum(self.max, other.max)
+        self.n = n
+
+    def summary(self, feature_name, first_band=1) -> Dict:
+        if self.n == 0:
+            return {}
+        std_dev = np.sqrt(self.m2 / self.n)
+        q1, median, q3 = self.sketch.quantiles([25, 50, 75])
+        columns = [
+            self.mean, std_dev, self.min, self.max, median, q1, q3, q3 - q1,
+            (self.m3 / self.n) / std_dev**3,
+            (self.m4 / self.n) / std_dev**4,
+        ]
+        stats = {}
+        for band in range(len(self.mean)):
+            for stat, values in zip(SUMMARY_STATISTICS, columns):
+                stats[f'{feature_name}_{first_band + band}_{stat}'] = values[band]
+        return stats
+
+
+class TrimFinder:
+    """ The interval librosa.effects.trim keeps, found from frame energies that arrive in pieces.
+
+    A frame is non-silent if its energy is within top_db of the loudest
+    frame's, which is only known at the end. Instead of every frame's energy,
+    only the frames that could still turn out to be the first or the last
+    non-silent one are kept: those louder than every earlier (or every
+    later) frame and within top_db of the loudest so far.
+    """
+
+    def __init__(self, top_db, hop_length=TRIM_HOP_LENGTH):
+        self.ratio = 10.0 ** (-top_db / 10.0)
+        self.hop_length = hop_length
+        self.peak = 0.0
+        self.frames = 0
+        self.rising = (np.zeros(0, dtype=np.int64), np.zeros(0))
+        self.falling = (np.zeros(0, dtype=np.int64), np.zeros(0))
+
+    def push(self, power):
+        """ Fold in the energies of the next frames, the maximum over channels for multichannel audio. """
+        # Like librosa, energies below the amplitude floor count as the floor
+        power = np.maximum(np.asarray(power, dtype=np.float64), TRIM_AMIN**2)
+        index = self.frames + np.arange(len(power))
+        self.frames += len(power)
+
+        earlier = np.maximum.accumulate(np.concatenate([[self.peak], power]))[:-1]
+        rising = power > earlier
+        later = np.concatenate([np.maximum.accumulate(power[::-1])[::-1][1:], [0.0]])
+        falling = power > later
+        falling_index, falling_power = self.falling
+        keep = falling_power > power.max()
+
+        self.peak = max(self.peak, power.max())
+        floor = self.peak * self.ratio
+        self.rising = self._above(floor, np.concatenate([self.rising[0], index[rising]]), np.concatenate([self.rising[1], power[rising]]))
+        self.falling = self._above(floor, np.concatenate([falling_index[keep], index[falling]]),
+                                   np.concatenate([falling_power[keep], power[falling]]))
+
+    @staticmethod
+    def _above(floor, index, power):
+        above = power > floor
+        return index[above], power[above]
+
+    def interval(self, samples):
+        """ (start, end) in samples of the trimmed signal, for a signal of samples samples. """
+        floor = self.peak * self.ratio
+        first = self.rising[0][self.rising[1] > floor]
+        last = self.falling[0][self.falling[1] > floor]
+        if not len(first):
+            return 0, 0
+        return int(first[0]) * self.hop_length, min(samples, (int(last[-1]) + 1) * self.hop_length)
+
+
+class TuningEstimator:
+    """ librosa.estimate_tuning of a power spectrogram that arrives in blocks.
+
+    Pitch residuals are counted per magnitude band of db_step dB, so the
+    median magnitude that estimate_tuning keeps peaks above, which needs
+    every peak, can be applied at the end to within one band.
+    """
+
+    def __init__(self, sr, bins_per_octave=12, resolution=0.01, db_range=(-250.0, 100.0), db_step=0.1):
+        self.sr = sr
+        self.bins_per_octave = bins_per_octave
+        self.edges = np.linspace(-0.5, 0.5, int(np.ceil(1.0 / resolution)) + 1)
+        self.db_low = db_range[0]
+        self.db_step = db_step
+        self.counts = np.zeros((int((db_range[1] - db_range[0]) / db_step), len(self.edges) - 1), dtype=np.int64)
+
+    def update(self, power):
+        pitch, mag = librosa.piptrack(S=power, sr=self.sr)
+        found = pitch > 0
+        pitch, mag = pitch[found], mag[found]
+        residual = np.mod(self.bins_per_octave * librosa.hz_to_octs(pitch), 1.0)
+        residual[residual >= 0.5] -= 1.0
+        residual_bin = np.clip(np.searchsorted(self.edges, residual, side='right') - 1, 0, self.counts.shape[1] - 1)
+        db = 10.0 * np.log10(np.maximum(mag, 1e-30))
+        db_bin = np.clip(((db - self.db_low) / self.db_step).astype(np.int64), 0, self.counts.shape[0] - 1)
+        np.add.at(self.counts, (db_bin, residual_bin), 1)
+
+    def tuning(self):
+        by_magnitude = self.counts.sum(axis=1)
+        if not by_magnitude.any():
+            return 0.0
+        median_band = np.searchsorted(np.cumsum(by_magnitude), by_magnitude.sum() / 2.0)
+        return float(self.edges[np.argmax(self.counts[median_band:].sum(axis=0))])
+
+
+class FrameBuffer:
+    """ Turns a stream of (channels, samples) blocks into frame-aligned segments.
+
+    pad samples are added at both ends, zeros or with pad_mode 'edge' copies
+    of the first and last sample, which reproduces centred framing. Each
+    push returns the samples spanning every complete frame so far (or
+    None); only the overlap with the next frame is kept.
+    """
+
+    def __init__(self, channels, frame_length, hop_length, pad=0, pad_mode='constant'):
+        self.frame_length = frame_length
+        self.hop_length = hop_length
+        self.pad = pad
+        self.pad_mode = pad_mode
+        self.buffer = np.zeros((channels, pad if pad_mode == 'constant' else 0), dtype=np.float32)
+        self.last = None
+
+    def push(self, samples):
+        if samples.shape[1] == 0:
+            return None
+        if self.last is None and self.pad_mode == 'edge':
+            self.buffer = np.repeat(samples[:, :1], self.pad, axis=1)
+        self.last = samples[:, -1:]
+        self.buffer = np.concatenate([self.buffer, samples], axis=1)
+        available = self.buffer.shape[1]
+        if available < self.frame_length:
+            return None
+        n_frames = 1 + (available - self.frame_length) // self.hop_length
+        segment = self.buffer[:, :(n_frames - 1) * self.hop_length + self.frame_length]
+        self.buffer = self.buffer[:, n_frames * self.hop_length:].copy()
+        return segment
+
+    def finish(self):
+        if self.pad == 0 or self.last is None:
+            return None
+        if self.pad_mode == 'edge':
+            return self.push(np.repeat(self.last, self.pad, axis=1))
+        return self.push(np.zeros((self.buffer.shape[0], self.pad), dtype=np.float32))
+
+
+def read_blocks(audio_path, sr=44100, block_samples=READ_BLOCK_SAMPLES):
+    """ Yield (channels, samples) float32 blocks of the file resampled to sr. """
+    info = sf.info(audio_path)
+    resampler = None
+    if info.samplerate != sr:
+        resampler = soxr.ResampleStream(info.samplerate, sr, info.channels, dtype='float32', quality='HQ')
+
+    for block in sf.blocks(audio_path, blocksize=block_samples, dtype='float32', always_2d=True):
+        if resampler is not None:
+            block = resampler.resample_chunk(block)
+        if len(block):
+            yield block.T
+
+    if resampler is not None:
+        tail = resampler.resample_chunk(np.zeros((0, info.channels), dtype=np.float32), last=True)
+        if len(tail):
+            yield tail.T
+
+
+def frame_power(segment, frame_length, hop_length):
+    """ Mean square of each frame of a (channels, samples) segment, as (channels, frames). """
+    frames = librosa.util.frame(segment, frame_length=frame_length, hop_length=hop_length)
+    return np.mean(frames**2, axis=-2)
+
+
+class PulseTracker:
+    """ PLP beat tracking over an onset envelope that arrives in pieces.
+
+    librosa.beat.plp runs on overlapping windows of window_frames envelope
+    frames; beats are taken from each window's interior, so every part of the
+    track is covered once, and only the inter-beat tempo statistics are kept.
+    """
+
+    def __init__(self, average_bpm, sr, hop_length, win_length, window_frames=None):
+        self.sr = sr
+        self.hop_length = hop_length
+        self.win_length = win_length
+        self.window_frames = window_frames or 8 * win_length
+        self.tempo_min = average_bpm * 0.8
+        self.tempo_max = average_bpm * 1.2
+        self.envelope = np.zeros(0)
+        self.offset = 0
+        self.valid_from = 0
+        self.last_beat = None
+        self.stats = RunningStats(1)
+
+    def push(self, envelope):
+        self.envelope = np.concatenate([self.envelope, envelope])
+        while len(self.envelope) >= self.window_frames:
+            self._track(last=False)
+
+    def finish(self):
+        if len(self.envelope) > 0:
+            self._track(last=True)
+
+    def _track(self, last):
+        window = self.envelope if last else self.envelope[:self.window_frames]
+        overlap = self.win_length
+        pulse = librosa.beat.plp(onset_envelope=window, sr=self.sr, hop_length=self.hop_length, win_length=self.win_length,
+                                 tempo_min=self.tempo_min, tempo_max=self.tempo_max)
+        valid_to = len(window) if last else len(window) - overlap // 2
+        beats = np.flatnonzero(librosa.util.localmax(pulse))
+        beats = beats[(beats >= self.valid_from) & (beats < valid_to)] + self.offset
+        if self.last_beat is not None:
+            beats = np.concatenate([[self.last_beat], beats])
+        if len(beats) > 1:
+            intervals = np.diff(librosa.frames_to_time(beats, sr=self.sr, hop_length=self.hop_length))
+            self.stats.update((60.0 / intervals)[np.newaxis, :])
+        if len(beats) > 0:
+            self.last_beat = beats[-1]
+
+        consumed = len(window) - overlap
+        self.envelope = self.envelope[consumed:] if not last else np.zeros(0)
+        self.offset += consumed
+        self.valid_from = overlap - overlap // 2
+
+
+def stream_features(audio_path: str,
+                    average_bpm: float,
+                    sr: int = 44100,
+                    n_fft: int = 4096,
+                    hop_length: int = 1024,
+                    mono_top_db: float = 60,
+                    stereo_top_db: float = 10,
+                    plp_hop_length: int = 512,
+                    plp_win_length: int = 1024,
+                    loudness_block_size: float = 0.4) -> Dict:
+    """ Extract the process_audio_file feature set in bounded memory.
+
+    The file is read three times in blocks. The first pass finds the
+    intervals the mono and stereo views are trimmed to, exactly as
+    librosa.effects.trim would, and the onset spectrogram's peak. The second
+    gathers what the in-memory extractors take from the whole spectrogram:
+    chroma's tuning and the peaks that the dB floors of MFCC and spectral
+    contrast are relative to. The third frames only the trimmed intervals,
+    centred like the in-memory extractors, and folds every extractor's
+    frames into RunningStats. The frames are the in-memory ones; what
+    remains approximate is the tuning's magnitude threshold, binned to 0.1
+    dB, the onset envelope, which is tracked in windows, and quantiles once
+    a track has more than SKETCH_CAPACITY frames. STREAM_TOLERANCE says how
+    close the results are to process_audio_file, except for the tempo of
+    tracks without a pulse, which follows noise in the onset envelope.
+    """
+    try:
+        mono_trim, stereo_trim = TrimFinder(mono_top_db), TrimFinder(stereo_top_db)
+        mono_frames, stereo_frames = None, None
+        onset_mel_basis = librosa.filters.mel(sr=sr, n_fft=2048)
+        onset_peak_frames = FrameBuffer(1, 2048, plp_hop_length, 1024)
+        onset_peak = -np.inf
+        samples = 0
+        for block in read_blocks(audio_path, sr):
+            if mono_frames is None:
+                mono_frames = FrameBuffer(1, TRIM_FRAME_LENGTH, TRIM_HOP_LENGTH, TRIM_FRAME_LENGTH // 2)
+                stereo_frames = FrameBuffer(block.shape[0], TRIM_FRAME_LENGTH, TRIM_HOP_LENGTH, TRIM_FRAME_LENGTH // 2)
+            samples += block.shape[1]
+            mono = block.mean(axis=0, keepdims=True)
+            trim_frames(mono_trim, mono_frames, mono)
+            trim_frames(stereo_trim, stereo_frames, block)
+            if average_bpm:
+                segment = onset_peak_frames.push(mono)
+                if segment is not None:
+                    onset_peak = max(onset_peak, power_db(onset_mel_basis @ onset_power(segment, plp_hop_length)).max())
+        if mono_frames is None:
+            return {}
+        trim_frames(mono_trim, mono_frames)
+        trim_frames(stereo_trim, stereo_frames)
+        segment = onset_peak_frames.finish() if average_bpm else None
+        if segment is not None:
+            onset_peak = max(onset_peak, power_db(onset_mel_basis @ onset_power(segment, plp_hop_length)).max())
+
+        mono_start, mono_end = mono_trim.interval(samples)
+        stereo_start, stereo_end = stereo_trim.interval(samples)
+        channels = stereo_frames.buffer.shape[0]
+
+        # The whole-track quantities the in-memory extractors derive from the full spectrogram
+        tuning = TuningEstimator(sr)
+        mel_basis = librosa.filters.mel(sr=sr, n_fft=n_fft)
+        mel_peak, contrast_peak, contrast_valley = -np.inf, -np.inf, -np.inf
+        for segment in framed(FrameBuffer(1, n_fft, hop_length, n_fft // 2), trimmed_blocks(audio_path, sr, mono_start, mono_end)):
+            S = np.abs(librosa.stft(segment[0], n_fft=n_fft, hop_length=hop_length, center=False))
+            power = S**2
+            tuning.update(power)
+            peaks, valleys = contrast_bands(S, sr, n_fft)
+            mel_peak = max(mel_peak, power_db(mel_basis @ power).max())
+            contrast_peak = max(contrast_peak, power_db(peaks).max())
+            contrast_valley = max(contrast_valley, power_db(valleys).max())
+        chroma_tuning = tuning.tuning()
+
+        loudness_block = int(loudness_block_size * sr)
+        n_mfcc, n_chroma, n_contrast = 13, 12, 7
+
+        spectral_frames = FrameBuffer(1, n_fft, hop_length, n_fft // 2)
+        zcr_frames = FrameBuffer(1, 2048, hop_length, 1024, pad_mode='edge')
+        onset_frames = FrameBuffer(1, 2048, plp_hop_length, 1024)
+        loudness_frames = FrameBuffer(channels, loudness_block, loudness_block)
+
+        spectral = {'centroid': RunningStats(1), 'bandwidth': RunningStats(1), 'flatness': RunningStats(1), 'rms': RunningStats(1),
+                    'mfcc': RunningStats(n_mfcc), 'chroma': RunningStats(n_chroma), 'contrast': RunningStats(n_contrast)}
+        zcr = RunningStats(1)
+        loudness = RunningStats(1)
+        pulse = PulseTracker(average_bpm, sr, plp_hop_length, plp_win_length) if average_bpm else None
+        previous_onset_frame = None
+
+        def spectral_segment(segment):
+            y = segment[0]
+            S = np.abs(librosa.stft(y, n_fft=n_fft, hop_length=hop_length, center=False))
+            power = S**2
+            peaks, valleys = contrast_bands(S, sr, n_fft)
+            for name, frames in (
+                ('centroid', librosa.feature.spectral_centroid(S=S, sr=sr)),
+                ('bandwidth', librosa.feature.spectral_bandwidth(S=S, sr=sr)),
+                ('flatness', librosa.feature.spectral_flatness(S=S)),
+                ('rms', librosa.feature.rms(y=y, frame_length=n_fft, hop_length=hop_length, center=False)),
+                ('mfcc', librosa.feature.mfcc(S=np.maximum(power_db(mel_basis @ power), mel_peak - TOP_DB), sr=sr, n_mfcc=n_mfcc)),
+                ('chroma', librosa.feature.chroma_stft(S=power, sr=sr, n_fft=n_fft, tuning=chroma_tuning)),
+                ('contrast', np.maximum(power_db(peaks), contrast_peak - TOP_DB) - np.maximum(power_db(valleys), contrast_valley - TOP_DB)),
+            ):
+                spectral[name].update(frames)
+
+        def zcr_segment(segment):
+            zcr.update(librosa.feature.zero_crossing_rate(segment[0], frame_length=2048, hop_length=hop_length, center=False))
+
+        def onset_segment(segment):
+            nonlocal previous_onset_frame
+            S = np.maximum(power_db(onset_mel_basis @ onset_power(segment, plp_hop_length)), onset_peak - TOP_DB)
+            if previous_onset_frame is None:
+                # librosa pads the lag plus half a frame's worth of hops at the start
+                head = np.zeros(1 + 2048 // (2 * plp_hop_length))
+            else:
+                S = np.concatenate([previous_onset_frame, S], axis=1)
+                head = np.zeros(0)
+            previous_onset_frame = S[:, -1:]
+            envelope = np.median(np.maximum(0.0, S[:, 1:] - S[:, :-1]), axis=0)
+            pulse.push(np.concatenate([head, envelope]))
+
+        def loudness_segment(segment):
+            values = block_loudness(segment.T, sr, loudness_block_size)
+            # Blocks the meter gates out come back as -inf and are dropped, as in analyze_loudness
+            loudness.update(values[np.isfinite(values)][np.newaxis, :])
+
+        offset = 0
+        for block in read_blocks(audio_path, sr):
+            mono = block.mean(axis=0, keepdims=True)
+            mono_trimmed = mono[:, max(0, mono_start - offset):max(0, mono_end - offset)]
+            stereo_trimmed = block[:, max(0, stereo_start - offset):max(0, stereo_end - offset)]
+            offset += block.shape[1]
+            for buffer, handler, data in ((spectral_frames, spectral_segment, mono_trimmed),
+                                          (zcr_frames, zcr_segment, mono_trimmed),
+                                          (onset_frames, onset_segment if pulse else None, mono),
+                                          (loudness_frames, loudness_segment, stereo_trimmed)):
+                if handler is None:
+                    continue
+                segment = buffer.push(data)
+                if segment is not None:
+                    handler(segment)
+
+        for buffer, handler in ((spectral_frames, spectral_segment), (zcr_frames, zcr_segment),
+                                (onset_frames, onset_segment if pulse else None)):
+            segment = buffer.finish() if handler is not None else None
+            if segment is not None:
+                handler(segment)
+
+        result = {}
+        if pulse is not None:
+            pulse.finish()
+            result.update(pulse.stats.summary('tempo'))
+        result.update(loudness.summary('loudness'))
+        for name, column_name in (('centroid', 'centroid'), ('bandwidth', 'bandwidth'), ('flatness', 'flatness')):
+            result.update(spectral[name].summary(column_name))
+        result.update(zcr.summary('zero_crossing'))
+        for name, column_name in (('rms', 'RMS Energy'), ('mfcc', 'mfcc'), ('chroma', 'chroma'), ('contrast', 'spectral_contrast')):
+            result.update(spectral[name].summary(column_name))
+        return result
+
+    except Exception as e:
+        raise_if_out_of_memory(e)
+        print(f"Error streaming features for {audio_path}: {e}")
+        traceback.print_exc()
+        return {}
+
+def streamed_definitions(sr=44100, n_fft=4096, hop_length=1024, plp_hop_length=512, plp_win_length=1024, loudness_block_size=0.4, **params):
+    """ The definition, as the feature registry records it, that stream_features computes each feature with, by feature name. """
+    spectral = {'version': 1, 'signal': 'mono_trimmed', 'n_fft': n_fft, 'hop_length': hop_length}
+    return {
+        'tempo': {'version': 1, 'signal': 'mono', 'hop_length': plp_hop_length, 'win_length': plp_win_length},
+        'loudness': {'version': 1, 'signal': 'stereo_trimmed', 'block_size': loudness_block_size},
+        'centroid': spectral,
+        'bandwidth': spectral,
+        'flatness': spectral,
+        'zero_crossing': {'version': 1, 'signal': 'mono_trimmed', 'hop_length': hop_length},
+        'RMS Energy': {'version': 1, 'signal': 'mono_trimmed', 'hop_length': hop_length, 'frame_length': n_fft},
+        'mfcc': {**spectral, 'win_length': n_fft, 'n_mfcc': 13},
+        'chroma': spectral,
+        'spectral_contrast': spectral,
+    }
+
+def compare_streamed(streamed, expected, tolerance=STREAM_TOLERANCE):
+    """ Compare stream_features output to process_audio_file's for the same track; returns human-readable differences. """
+    differences = []
+    for key in sorted(set(streamed) | set(expected)):
+        if key not in streamed or key not in expected:
+            differences.append(f'{key}: only in {"in-memory" if key in expected else "streamed"} output')
+            continue
+        actual, wanted = float(streamed[key]), float(expected[key])
+        column, _, stat = key.rpartition('_')
+        if stat in QUANTILE_STATISTICS:
+            allowed = tolerance['quantile_iqr'] * abs(float(expected.get(f'{column}_iqr', 0.0)))
+            close = abs(actual - wanted) <= max(allowed, tolerance['atol'])
+        else:
+            close = np.isclose(actual, wanted, rtol=tolerance['rtol'], atol=tolerance['atol'], equal_nan=True)
+        if not close:
+            differences.append(f'{key}: streamed {actual!r}, in memory {wanted!r}')
+    return differences
+
+def onset_power(segment, hop_length):
+    return np.abs(librosa.stft(segment[0], n_fft=2048, hop_length=hop_length, center=False))**2
+
+def power_db(S):
+    """ librosa.power_to_db without the top_db floor, which is applied with the whole track's maximum instead. """
+    return librosa.power_to_db(S, top_db=None)
+
+def contrast_bands(S, sr, n_fft, n_bands=6, fmin=200.0, quantile=0.02):
+    """ The per-band peak and valley energies librosa.feature.spectral_contrast takes the dB difference of. """
+    freq = librosa.fft_frequencies(sr=sr, n_fft=n_fft)
+    octa = np.zeros(n_bands + 2)
+    octa[1:] = fmin * (2.0 ** np.arange(0, n_bands + 1))
+    peaks = np.zeros((n_bands + 1, S.shape[-1]))
+    valleys = np.zeros_like(peaks)
+    for k, (f_low, f_high) in enumerate(zip(octa[:-1], octa[1:])):
+        current_band = np.logical_and(freq >= f_low, freq <= f_high)
+        idx = np.flatnonzero(current_band)
+        if k > 0:
+            current_band[idx[0] - 1] = True
+        if k == n_bands:
+            current_band[idx[-1] + 1:] = True
+        sub_band = S[current_band]
+        if k < n_bands:
+            sub_band = sub_band[:-1]
+        # Always take at least one bin from each side
+        count = max(int(np.rint(quantile * np.sum(current_band))), 1)
+        ordered = np.sort(sub_band, axis=0)
+        valleys[k] = np.mean(ordered[:count], axis=0)
+        peaks[k] = np.mean(ordered[-count:], axis=0)
+    return peaks, valleys
+
+def trimmed_blocks(audio_path, sr, start, end):
+    """ Yield the (1, samples) mono blocks of the file's samples from start to end. """
+    offset = 0
+    for block in read_blocks(audio_path, sr):
+        mono = block.mean(axis=0, keepdims=True)[:, max(0, start - offset):max(0, end - offset)]
+        offset += block.shape[1]
+        if mono.shape[1]:
+            yield mono
+        if offset >= end:
+            break
+
+def framed(frames, blocks):
+    """ Yield the frame-aligned segments a FrameBuffer cuts from blocks, the padded last one included. """
+    for block in blocks:
+        segment = frames.push(block)
+        if segment is not None:
+            yield segment
+    segment = frames.finish()
+    if segment is not None:
+        yield segment
+
+def trim_frames(trim, frames, block=None):
+    """ Feed the energies of the trim frames completed by block, or the last ones when block is None, to trim. """
+    segment = frames.push(block) if block is not None else frames.finish()
+    if segment is not None:
+        trim.push(frame_power(segment, TRIM_FRAME_LENGTH, TRIM_HOP_LENGTH).max(axis=0))
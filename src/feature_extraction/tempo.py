@@ -2,10 +2,10 @@ import os
 import numpy as np
 import soundfile as sf
 import librosa
-import matplotlib.pyplot as plt
 import traceback
 from typing import Dict
-from utility_functions import load_audio_mono, extract_summary_statistics, ensure_directory_exists
+from utility_functions import load_audio_mono, extract_summary_statistics, ensure_directory_exists, ExtractionFailed, raise_if_out_of_memory
+from plotting import render_plot, finish_figure
 
 def extract_isrc(audio_path: str) -> str:
     return os.path.splitext(os.path.basename(audio_path))[0]
@@ -49,8 +49,10 @@ def save_plp_function(audio_path: str, y: np.ndarray, pulse: np.ndarray, sr: int
         print(f"Error in save_plp_function for {audio_path}: {e}")
         traceback.print_exc()
 
-def plot_plp_graph(pulse: np.ndarray, beat_times: np.ndarray, sr: int, hop_length: int):
+def plot_plp_graph(pulse: np.ndarray, beat_times: np.ndarray, sr: int, hop_length: int, output_path: str = None):
     try:
+        import matplotlib.pyplot as plt
+        import librosa.display
         times = librosa.times_like(pulse, sr=sr, hop_length=hop_length)
         fig, ax = plt.subplots(figsize=(8, 2))
         ax.plot(times, librosa.util.normalize(pulse), label='PLP', color='b')
@@ -59,12 +61,16 @@ def plot_plp_graph(pulse: np.ndarray, beat_times: np.ndarray, sr: int, hop_lengt
         ax.set_title('Tempo Over Time')
         ax.xaxis.set_major_formatter(librosa.display.TimeFormatter())
         plt.tight_layout()
-        plt.show()
+        finish_figure(plt, output_path)
 
     except Exception as e:
         print(f"Error in plot_plp_graph: {e}")
         traceback.print_exc()
 
+def onset_strength(y: np.ndarray, sr: int = 44100, hop_length: int = 512) -> np.ndarray:
+    """ The onset envelope librosa.beat.plp would compute from y. """
+    return librosa.onset.onset_strength(y=y, sr=sr, hop_length=hop_length, aggregate=np.median)
+
 def plp(y: np.ndarray, 
         audio_path: str, 
         average_bpm: float, 
@@ -73,15 +79,21 @@ def plp(y: np.ndarray,
         win_length: int = 1024, 
         save_audio_with_clicks: bool = False, 
         save_plp: bool = False, 
-        plot_graph: bool = False) -> Dict:
-    if average_bpm == 0.0 or y is None:
+        plot_graph: bool = False,
+        onset_envelope: np.ndarray = None) -> Dict:
+    # Without a tempo there is no range to look for a pulse in: nothing to summarise, which is not a failure
+    if average_bpm == 0.0:
         return {}
+    if y is None and onset_envelope is None:
+        return ExtractionFailed()
 
     try:
         tempo_min = average_bpm * 0.8
         tempo_max = average_bpm * 1.2
 
-        pulse = librosa.beat.plp(y=y, sr=sr, hop_length=hop_length, win_length=win_length, tempo_min=tempo_min, tempo_max=tempo_max)
+        if onset_envelope is None:
+            onset_envelope = onset_strength(y, sr, hop_length)
+        pulse = librosa.beat.plp(onset_envelope=onset_envelope, sr=sr, hop_length=hop_length, win_length=win_length, tempo_min=tempo_min, tempo_max=tempo_max)
         beats_plp = np.flatnonzero(librosa.util.localmax(pulse))
         beat_times = librosa.frames_to_time(beats_plp, sr=sr, hop_length=hop_length)
 
@@ -98,14 +110,15 @@ def plp(y: np.ndarray,
             save_plp_function(audio_path, y, pulse, sr, hop_length)
 
         if plot_graph:
-            plot_plp_graph(pulse, beat_times, sr, hop_length)
+            render_plot(plot_plp_graph, pulse, beat_times, sr, hop_length)
 
         return summary_stats
 
     except Exception as e:
+        raise_if_out_of_memory(e)
         print(f"Error in plp function for {audio_path}: {e}")
         traceback.print_exc()
-        return {}
+        return ExtractionFailed()
 
 if __name__ == "__main__":
     audio_path = '/Volumes/Samsung T7/tracks/SE5IB2236769.wav'
@@ -0,0 +1,156 @@
+import time
+import errno
+import resource
+import traceback
+import multiprocessing
+from multiprocessing.connection import wait
+
+from instrumentation import peak_rss_mb
+
+TASK_OK = 'ok'
+TASK_FAILED = 'failed'
+
+
+class SupervisedPool:
+    """ Worker processes that each run one task at a time under a time and memory budget.
+
+    Tasks are pulled from an iterator only when a worker is free, so input
+    is consumed lazily. A worker still busy after timeout seconds is killed
+    and replaced, as is one that dies. memory_limit_mb caps each worker's
+    address space where the platform supports it, turning runaway
+    allocations into a MemoryError, and a worker whose peak RSS has passed
+    the budget is recycled after its task.
+    """
+
+    def __init__(self, workers, function, timeout=None, memory_limit_mb=None):
+        self.workers = workers
+        self.function = function
+        self.timeout = timeout
+        self.memory_limit_mb = memory_limit_mb
+        self._context = multiprocessing.get_context()
+        self._busy = {}
+
+    def run(self, tasks):
+        """ Run function(*args) for every (task_id, args) in tasks; yields (task_id, status, value).
+
+        value is the function's return value when status is TASK_OK and the
+        reason for the failure otherwise.
+        """
+        tasks = iter(tasks)
+        idle = [self._spawn() for _ in range(self.workers)]
+        exhausted = False
+        try:
+            while True:
+                while idle and not exhausted:
+                    task = next(tasks, None)
+                    if task is None:
+                        exhausted = True
+                        break
+                    worker = idle.pop()
+                    worker.connection.send(task)
+                    self._busy[worker] = (task[0], time.monotonic())
+                if not self._busy:
+                    return
+
+                for worker, status, value, retire in self._poll():
+                    task_id, _ = self._busy.pop(worker)
+                    if retire:
+                        self._stop(worker)
+                        worker = self._spawn()
+                    idle.append(worker)
+                    yield task_id, status, value
+        finally:
+            for worker in idle + list(self._busy):
+                self._stop(worker)
+            self._busy = {}
+
+    def _poll(self):
+        deadline = None
+        if self.timeout is not None:
+            deadline = min(started for _, started in self._busy.values()) + self.timeout
+        wait_for = max(0.0, deadline - time.monotonic()) if deadline is not None else None
+
+        by_handle = {}
+        for worker in self._busy:
+            by_handle[worker.connection] = worker
+            by_handle[worker.process.sentinel] = worker
+        ready = wait(list(by_handle), timeout=wait_for)
+
+        finished = []
+        handled = set()
+        for handle in ready:
+            worker = by_handle[handle]
+            if worker in handled:
+                continue
+            handled.add(worker)
+            try:
+                status, value, retire = worker.connection.recv()
+            except (EOFError, OSError):
+                worker.process.join()
+                status, value, retire = TASK_FAILED, f'worker exited with code {worker.process.exitcode}', True
+            finished.append((worker, status, value, retire))
+
+        if self.timeout is not None:
+            now = time.monotonic()
+            for worker, (_, started) in self._busy.items():
+                if worker not in handled and now - started >= self.timeout:
+                    finished.append((worker, TASK_FAILED, f'timed out after {self.timeout:.0f}s', True))
+        return finished
+
+    def _spawn(self):
+        parent_end, child_end = self._context.Pipe()
+        process = self._context.Process(target=_worker_loop, args=(child_end, self.function, self.memory_limit_mb), daemon=True)
+        process.start()
+        child_end.close()
+        return Worker(process, parent_end)
+
+    def _stop(self, worker):
+        if worker.process.is_alive():
+            worker.process.kill()
+        worker.process.join()
+        worker.connection.close()
+
+
+class Worker:
+    def __init__(self, process, connection):
+        self.process = process
+        self.connection = connection
+
+
+def _limit_address_space(memory_limit_mb):
+    try:
+        with open('/proc/self/statm', 'r') as f:
+            size = int(f.read().split()[0]) * resource.getpagesize()
+        limit = size + int(memory_limit_mb * 1024**2)
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+    except (OSError, ValueError):
+        pass  # No /proc or not enforceable (e.g. macOS); the RSS check still recycles the worker
+
+def _worker_loop(connection, function, memory_limit_mb):
+    if memory_limit_mb is not None:
+        _limit_address_space(memory_limit_mb)
+    rss_limit_mb = peak_rss_mb() + memory_limit_mb if memory_limit_mb is not None else None
+
+    while True:
+        try:
+            task = connection.recv()
+        except EOFError:
+            return
+        _, args = task
+        try:
+            status, value = TASK_OK, function(*args)
+        except MemoryError:
+            status, value = TASK_FAILED, 'memory budget exceeded'
+        except Exception as e:
+            if isinstance(e, OSError) and e.errno == errno.ENOMEM:
+                status, value = TASK_FAILED, 'memory budget exceeded'
+            else:
+                traceback.print_exc()
+                status, value = TASK_FAILED, f'{type(e).__name__}: {e}'
+
+        # Peak RSS never goes down, so a worker past its budget (or one that hit
+        # a MemoryError and may be left in a bad state) is replaced by a fresh one
+        retire = rss_limit_mb is not None and (peak_rss_mb() > rss_limit_mb or status == TASK_FAILED)
+        connection.send((status, value, retire))
+        if retire:
+            return
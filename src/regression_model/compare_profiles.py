@@ -0,0 +1,113 @@
+import argparse
+import numpy as np
+import pandas as pd
+from sklearn.model_selection import train_test_split, GridSearchCV
+from sklearn.ensemble import RandomForestRegressor
+from sklearn.metrics import r2_score
+from grid_search import load_data, prepare_data, PARAM_GRID, TARGETS
+
+def align(reference, candidate):
+    """ The rows of both feature tables for the ISRCs they share, in the same order. """
+    reference = reference.assign(isrc=reference['isrc'].astype(str))
+    candidate = candidate.assign(isrc=candidate['isrc'].astype(str))
+    shared = sorted(set(reference['isrc']) & set(candidate['isrc']))
+    reference = reference.set_index('isrc').loc[shared].reset_index()
+    candidate = candidate.set_index('isrc').loc[shared].reset_index()
+    return reference, candidate
+
+def column_drift(reference, candidate):
+    """ Per feature column, how far the candidate profile's values are from the reference's, over the shared tracks.
+
+    drift is the mean absolute difference in units of the reference column's
+    standard deviation across tracks, so columns of any scale compare;
+    correlation shows whether tracks keep their order, which is what the
+    forest mostly depends on.
+    """
+    rows = []
+    for column in reference.columns.intersection(candidate.columns).drop('isrc'):
+        a = pd.to_numeric(reference[column], errors='coerce').to_numpy(dtype=float)
+        b = pd.to_numeric(candidate[column], errors='coerce').to_numpy(dtype=float)
+        valid = ~(np.isnan(a) | np.isnan(b))
+        a, b = a[valid], b[valid]
+        if not len(a):
+            continue
+        difference = np.abs(b - a)
+        spread = a.std()
+        rows.append({
+            'column': column,
+            'tracks': len(a),
+            'mean_abs_diff': difference.mean(),
+            'max_abs_diff': difference.max(),
+            'drift': difference.mean() / spread if spread > 0 else np.nan,
+            'correlation': np.corrcoef(a, b)[0, 1] if spread > 0 and b.std() > 0 else np.nan,
+        })
+    return pd.DataFrame(rows).sort_values('drift', ascending=False, na_position='last').reset_index(drop=True)
+
+def model_rows(data, valence_energy_data):
+    """ The scaled features and targets of the rows grid_search.py would train on, indexed by ISRC. """
+    merged_data, _, X, y_valence, y_energy = prepare_data(data, valence_energy_data)
+    isrcs = merged_data.loc[X.index, 'isrc'].astype(str).to_numpy()
+    targets = pd.DataFrame({'valence': y_valence.to_numpy(), 'energy': y_energy.to_numpy()}, index=isrcs)
+    return X.set_axis(isrcs), targets
+
+def test_scores(X, targets, train, test, search=False, params=None):
+    """ Test R^2 per target of the grid_search.py model trained on the train ISRCs of X and tested on the test ones.
+
+    With search, each target's parameters are tuned over PARAM_GRID as in
+    grid_search.py; otherwise the forest is fit with params.
+    """
+    X_train, X_test = X.loc[train], X.loc[test]
+    scores = {}
+    for target in TARGETS:
+        y_train, y_test = targets.loc[train, target], targets.loc[test, target]
+        if search:
+            model = GridSearchCV(estimator=RandomForestRegressor(random_state=42), param_grid=PARAM_GRID, cv=3, n_jobs=-1).fit(X_train, y_train)
+        else:
+            model = RandomForestRegressor(random_state=42, n_jobs=-1, **(params or {})).fit(X_train, y_train)
+        scores[target] = r2_score(y_test, model.predict(X_test))
+    return scores
+
+def compare_profiles(reference, candidate, valence_energy_data=None, search=False, params=None):
+    """ Drift of every column and, given the targets, the model's test R^2 on both profiles' features of the same tracks. """
+    reference, candidate = align(reference, candidate)
+    drift = column_drift(reference, candidate)
+    scores = None
+    if valence_energy_data is not None:
+        X_reference, targets = model_rows(reference, valence_energy_data)
+        X_candidate, _ = model_rows(candidate, valence_energy_data)
+        # One split of the tracks both profiles can train on, so the scores differ only by the features
+        shared = sorted(set(X_reference.index) & set(X_candidate.index))
+        train, test = train_test_split(shared, test_size=0.2, random_state=42)
+        scores = pd.DataFrame({
+            'reference': test_scores(X_reference, targets, train, test, search, params),
+            'candidate': test_scores(X_candidate, targets, train, test, search, params),
+        })
+        scores['change'] = scores['candidate'] - scores['reference']
+    return len(reference), drift, scores
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare the features of two extraction profiles, e.g. full and fast, on the same tracks.")
+    parser.add_argument("reference", help="Feature output of the reference profile (Parquet parts directory or CSV)")
+    parser.add_argument("candidate", help="Feature output of the profile under evaluation")
+    parser.add_argument("--targets", default='tracks_info.csv', help="CSV with isrc, valence and energy; an empty string skips the model")
+    parser.add_argument("--grid-search", action="store_true", help="Tune the model over the full grid for each profile (slow)")
+    parser.add_argument("--n-estimators", type=int, default=300, help="Forest size when not grid searching")
+    parser.add_argument("--top", type=int, default=20, help="Number of most drifting columns to print")
+    parser.add_argument("--output", default='profile_drift.csv', help="Write the drift of every column to this CSV")
+    args = parser.parse_args()
+
+    reference = load_data(args.reference)
+    candidate = load_data(args.candidate)
+    valence_energy_data = load_data(args.targets) if args.targets else None
+    if reference is None or candidate is None:
+        exit()
+
+    tracks, drift, scores = compare_profiles(reference, candidate, valence_energy_data, args.grid_search, {'n_estimators': args.n_estimators})
+    print(f"{tracks} tracks in both outputs, {len(drift)} columns compared")
+    print(f"Median drift {drift['drift'].median():.3f} standard deviations, median correlation {drift['correlation'].median():.3f}")
+    with pd.option_context('display.width', 200, 'display.max_columns', None):
+        print(drift.head(args.top).to_string(index=False))
+        if scores is not None:
+            print("\nTest R^2 of the model trained on each profile's features:")
+            print(scores.to_string())
+    drift.to_csv(args.output, index=False)
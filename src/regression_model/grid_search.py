@@ -1,18 +1,40 @@
+import os
+import sys
+import argparse
 import pandas as pd
 import matplotlib.pyplot as plt
 from sklearn.preprocessing import MinMaxScaler
 from sklearn.model_selection import train_test_split, GridSearchCV
 from sklearn.ensemble import RandomForestRegressor
-from sklearn.metrics import mean_squared_error, r2_score
+from sklearn.metrics import mean_squared_error, r2_score, make_scorer
 import numpy as np
+from halving_search import SuccessiveHalvingForestSearch
+
+# Feature outputs are read with feature_extraction's own helpers, so both sides agree on the layout
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'feature_extraction'))
+from feature_store import read_features, FINGERPRINT_PREFIX
+
+TARGETS = ['valence', 'energy']
+PARAM_GRID = {
+    'n_estimators': [100, 200, 300],
+    'max_features': ['sqrt', 'log2', None],
+    'max_depth': [None, 10, 20, 30],
+    'min_samples_split': [2, 5, 10],
+    'min_samples_leaf': [1, 2, 4]
+}
 
 def load_data(filepath):
+    """ Read a CSV, or the Parquet parts directory written by feature_extraction/main.py with its latest row per ISRC. """
     try:
-        data = pd.read_csv(filepath)
-        return data
+        data = read_features(filepath)
     except FileNotFoundError:
         print(f"Error: The file {filepath} does not exist.")
         return None
+    if os.path.isdir(filepath) and data.empty:
+        print(f"Error: No feature parts found in {filepath}.")
+        return None
+    # Fingerprint columns only record how each feature group was computed
+    return data.drop(columns=[column for column in data.columns if column.startswith(FINGERPRINT_PREFIX)])
 
 def normalize_features(data, features, feature_range=(0, 1)):
     scaler = MinMaxScaler(feature_range=feature_range)
@@ -20,6 +42,74 @@ def normalize_features(data, features, feature_range=(0, 1)):
     scaled_df = pd.DataFrame(scaled_features, columns=features)
     return scaled_df, scaler
 
+def prepare_data(data, valence_energy_data):
+    """ Join the features to the valence and energy targets, scale them and drop rows with missing values.
+
+    Returns the joined data, the feature columns, the scaled features and both targets.
+    """
+    merged_data = pd.merge(data, valence_energy_data[['isrc', 'valence', 'energy']], on='isrc')
+
+    features = merged_data.columns.difference(['isrc', 'valence', 'energy'])
+
+    scaled_df, scaler = normalize_features(merged_data, features)
+
+    X = scaled_df
+    y_valence = merged_data['valence']
+    y_energy = merged_data['energy']
+
+    # Check for NaN values in the features and target
+    if X.isna().any().any():
+        print("NaN values found in features, removing rows with NaN values.")
+        nan_indices = X.isna().any(axis=1)
+        X = X.dropna()
+        y_valence = y_valence[~nan_indices]
+        y_energy = y_energy[~nan_indices]
+
+    if y_valence.isna().any():
+        print("NaN values found in valence, removing rows with NaN values.")
+        nan_indices = y_valence.isna()
+        y_valence = y_valence.dropna()
+        X = X[~nan_indices]
+        y_energy = y_energy[~nan_indices]
+
+    if y_energy.isna().any():
+        print("NaN values found in energy, removing rows with NaN values.")
+        nan_indices = y_energy.isna()
+        y_energy = y_energy.dropna()
+        X = X[~nan_indices]
+        y_valence = y_valence[~nan_indices]
+
+    return merged_data, features, X, y_valence, y_energy
+
+def target_r2(y_true, y_pred, column):
+    return r2_score(y_true[:, column], y_pred[:, column])
+
+def make_search(search='grid', eta=3, min_trees=10, joint=False):
+    """ The hyperparameter search over PARAM_GRID: exhaustive, or successive halving with the number of trees as the budget.
+
+    joint searches one multi-output forest for all TARGETS, given as the
+    columns of y, ranking candidates by their mean R^2 and scoring each
+    target too.
+    """
+    if search == 'halving':
+        return SuccessiveHalvingForestSearch(PARAM_GRID, cv=3, eta=eta, min_trees=min_trees, random_state=42, n_jobs=-1)
+    if joint:
+        scoring = {'r2': 'r2', **{target: make_scorer(target_r2, column=column) for column, target in enumerate(TARGETS)}}
+        return GridSearchCV(estimator=RandomForestRegressor(random_state=42), param_grid=PARAM_GRID, cv=3, n_jobs=-1, verbose=2,
+                            scoring=scoring, refit='r2')
+    return GridSearchCV(estimator=RandomForestRegressor(random_state=42), param_grid=PARAM_GRID, cv=3, n_jobs=-1, verbose=2)
+
+def target_cv_scores(search):
+    """ Cross-validation R^2 of each target for the best candidate of a joint search. """
+    if isinstance(search, GridSearchCV):
+        return {target: search.cv_results_[f'mean_test_{target}'][search.best_index_] for target in TARGETS}
+    return dict(zip(TARGETS, search.best_target_scores_))
+
+def target_predictions(model, X, column):
+    """ One target's predictions, from a single-target model or a joint one. """
+    predictions = model.predict(X)
+    return predictions[:, column] if predictions.ndim == 2 else predictions
+
 def save_results(data, filepath):
     data.to_csv(filepath, index=False)
 
@@ -64,6 +154,15 @@ def plot_valence_energy_distribution(valence, energy):
     plt.show()
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Tune random forests predicting valence and energy from the extracted features.")
+    parser.add_argument("--search", choices=['grid', 'halving'], default='grid',
+                        help="'grid' fits every configuration with every tree count; 'halving' drops the weakest as trees are added")
+    parser.add_argument("--eta", type=int, default=3, help="Halving: keep the best 1/eta of the candidates at each rung")
+    parser.add_argument("--min-trees", type=int, default=10, help="Halving: trees per candidate at the first rung, at least")
+    parser.add_argument("--joint", action="store_true",
+                        help="Fit one multi-output forest for valence and energy instead of a separate search per target")
+    args = parser.parse_args()
+
     input_filepath = 'tracks_features.csv'
     valence_energy_filepath = 'tracks_info.csv'
     output_filepath = 'predicted_valence_energy_scores_rf.csv'
@@ -78,81 +177,52 @@ if __name__ == "__main__":
         print("Error: The 'valence', 'energy', or 'isrc' column is not present in the valence data.")
         exit()
 
-    merged_data = pd.merge(data, valence_energy_data[['isrc', 'valence', 'energy']], on='isrc')
-
-    features = merged_data.columns.difference(['isrc', 'valence', 'energy'])
-
-    scaled_df, scaler = normalize_features(merged_data, features)
-
-    X = scaled_df
-    y_valence = merged_data['valence']
-    y_energy = merged_data['energy']
+    merged_data, features, X, y_valence, y_energy = prepare_data(data, valence_energy_data)
 
-    # Check for NaN values in the features and target
-    if X.isna().any().any():
-        print("NaN values found in features, removing rows with NaN values.")
-        nan_indices = X.isna().any(axis=1)
-        X = X.dropna()
-        y_valence = y_valence[~nan_indices]
-        y_energy = y_energy[~nan_indices]
+    X_train, X_test, y_train_valence, y_test_valence, y_train_energy, y_test_energy = train_test_split(X, y_valence, y_energy, test_size=0.2, random_state=42)
 
-    if y_valence.isna().any():
-        print("NaN values found in valence, removing rows with NaN values.")
-        nan_indices = y_valence.isna()
-        y_valence = y_valence.dropna()
-        X = X[~nan_indices]
-        y_energy = y_energy[~nan_indices]
+    plot_valence_energy_distribution(y_train_valence, y_train_energy)
 
-    if y_energy.isna().any():
-        print("NaN values found in energy, removing rows with NaN values.")
-        nan_indices = y_energy.isna()
-        y_energy = y_energy.dropna()
-        X = X[~nan_indices]
-        y_valence = y_valence[~nan_indices]
+    if args.joint:
+        # Both targets share the folds and every tree, so each candidate is fit once instead of twice
+        joint_search = make_search(args.search, args.eta, args.min_trees, joint=True)
+        joint_search.fit(X_train, np.column_stack([y_train_valence, y_train_energy]))
 
-    X_train, X_test, y_train_valence, y_test_valence, y_train_energy, y_test_energy = train_test_split(X, y_valence, y_energy, test_size=0.2, random_state=42)
+        print(f"Best parameters for valence and energy: {joint_search.best_params_}")
+        print(f"Best cross-validation score for valence and energy: {joint_search.best_score_}")
+        for target, score in target_cv_scores(joint_search).items():
+            print(f"Best cross-validation score for {target}: {score}")
 
-    plot_valence_energy_distribution(y_train_valence, y_train_energy)
+        # The search has already refit the best model on all of X_train
+        best_rf_model_valence = best_rf_model_energy = joint_search.best_estimator_
+    else:
+        grid_search_valence = make_search(args.search, args.eta, args.min_trees)
+        grid_search_valence.fit(X_train, y_train_valence)
 
-    param_grid = {
-        'n_estimators': [100, 200, 300],
-        'max_features': ['sqrt', 'log2', None],
-        'max_depth': [None, 10, 20, 30],
-        'min_samples_split': [2, 5, 10],
-        'min_samples_leaf': [1, 2, 4]
-    }
+        best_params_valence = grid_search_valence.best_params_
+        best_score_valence = grid_search_valence.best_score_
+        print(f"Best parameters for valence: {best_params_valence}")
+        print(f"Best cross-validation score for valence: {best_score_valence}")
 
-    rf_model_valence = RandomForestRegressor(random_state=42)
-    grid_search_valence = GridSearchCV(estimator=rf_model_valence, param_grid=param_grid, cv=3, n_jobs=-1, verbose=2)
-    grid_search_valence.fit(X_train, y_train_valence)
+        grid_search_energy = make_search(args.search, args.eta, args.min_trees)
+        grid_search_energy.fit(X_train, y_train_energy)
 
-    best_params_valence = grid_search_valence.best_params_
-    best_score_valence = grid_search_valence.best_score_
-    print(f"Best parameters for valence: {best_params_valence}")
-    print(f"Best cross-validation score for valence: {best_score_valence}")
+        best_params_energy = grid_search_energy.best_params_
+        best_score_energy = grid_search_energy.best_score_
+        print(f"Best parameters for energy: {best_params_energy}")
+        print(f"Best cross-validation score for energy: {best_score_energy}")
 
-    best_rf_model_valence = grid_search_valence.best_estimator_
-    best_rf_model_valence.fit(X_train, y_train_valence)
-    y_pred_valence = best_rf_model_valence.predict(X_test)
+        # The searches have already refit their best models on all of X_train
+        best_rf_model_valence = grid_search_valence.best_estimator_
+        best_rf_model_energy = grid_search_energy.best_estimator_
 
+    y_pred_valence = target_predictions(best_rf_model_valence, X_test, 0)
     mse_valence = mean_squared_error(y_test_valence, y_pred_valence)
     r2_valence = r2_score(y_test_valence, y_pred_valence)
     print(f"Tuned Random Forest for Valence - Mean Squared Error: {mse_valence}")
     print(f"Tuned Random Forest for Valence - R^2 Score: {r2_valence}")
 
-    rf_model_energy = RandomForestRegressor(random_state=42)
-    grid_search_energy = GridSearchCV(estimator=rf_model_energy, param_grid=param_grid, cv=3, n_jobs=-1, verbose=2)
-    grid_search_energy.fit(X_train, y_train_energy)
-
-    best_params_energy = grid_search_energy.best_params_
-    best_score_energy = grid_search_energy.best_score_
-    print(f"Best parameters for energy: {best_params_energy}")
-    print(f"Best cross-validation score for energy: {best_score_energy}")
-
-    best_rf_model_energy = grid_search_energy.best_estimator_
-    best_rf_model_energy.fit(X_train, y_train_energy)
-    y_pred_energy = best_rf_model_energy.predict(X_test)
-
+    y_pred_energy = target_predictions(best_rf_model_energy, X_test, 1)
     mse_energy = mean_squared_error(y_test_energy, y_pred_energy)
     r2_energy = r2_score(y_test_energy, y_pred_energy)
     print(f"Tuned Random Forest for Energy - Mean Squared Error: {mse_energy}")
@@ -160,15 +230,16 @@ if __name__ == "__main__":
 
     plot_predictions(y_test_valence, y_pred_valence, y_test_energy, y_pred_energy)
     plot_feature_importances(best_rf_model_valence, features)
-    plot_feature_importances(best_rf_model_energy, features)
+    if best_rf_model_energy is not best_rf_model_valence:
+        plot_feature_importances(best_rf_model_energy, features)
 
     # Ensure that the length of the DataFrame and the predicted values are the same
     if len(X) != len(merged_data):
         print("Length mismatch between features and merged data. Adjusting the DataFrame.")
         merged_data = merged_data.loc[X.index]
 
-    merged_data['predicted_valence_rf'] = best_rf_model_valence.predict(X)
-    merged_data['predicted_energy_rf'] = best_rf_model_energy.predict(X)
+    merged_data['predicted_valence_rf'] = target_predictions(best_rf_model_valence, X, 0)
+    merged_data['predicted_energy_rf'] = target_predictions(best_rf_model_energy, X, 1)
 
     merged_data['predicted_valence_rf'] = (merged_data['predicted_valence_rf'] - merged_data['predicted_valence_rf'].min()) / (merged_data['predicted_valence_rf'].max() - merged_data['predicted_valence_rf'].min())
     merged_data['predicted_energy_rf'] = (merged_data['predicted_energy_rf'] - merged_data['predicted_energy_rf'].min()) / (merged_data['predicted_energy_rf'].max() - merged_data['predicted_energy_rf'].min())
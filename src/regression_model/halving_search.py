@@ -0,0 +1,94 @@
+import math
+import itertools
+import numpy as np
+from sklearn.ensemble import RandomForestRegressor
+from sklearn.metrics import r2_score
+from sklearn.model_selection import KFold
+
+class SuccessiveHalvingForestSearch:
+    """ Successive-halving search over RandomForestRegressor parameters with the number of trees as the budget.
+
+    Every combination of the other parameters in param_grid starts out
+    with few trees. After each rung only the best 1/eta by mean
+    cross-validated R^2 go on, and their forests are warm-started to eta
+    times as many trees rather than refit from scratch. In the last rung
+    the survivors grow through each of param_grid's n_estimators values,
+    so the number of trees is still chosen from the grid. Exposes
+    best_params_, best_score_ and best_estimator_ (refit on all of X) like
+    GridSearchCV. With several target columns in y one multi-output forest
+    is fit per candidate, ranked by the mean R^2 over the targets;
+    best_target_scores_ holds the best candidate's R^2 for each target.
+    """
+
+    def __init__(self, param_grid, cv=3, eta=3, min_trees=10, random_state=42, n_jobs=-1, verbose=1):
+        self.param_grid = param_grid
+        self.cv = cv
+        self.eta = eta
+        self.min_trees = min_trees
+        self.random_state = random_state
+        self.n_jobs = n_jobs
+        self.verbose = verbose
+
+    def candidates(self):
+        names = [name for name in self.param_grid if name != 'n_estimators']
+        return [dict(zip(names, values)) for values in itertools.product(*(self.param_grid[name] for name in names))]
+
+    def rungs(self, n_candidates):
+        """ Trees per candidate at each rung before the last; the last grows through the grid's n_estimators. """
+        tree_counts = sorted(self.param_grid.get('n_estimators', [100]))
+        n_rungs = min(math.ceil(math.log(n_candidates, self.eta)) if n_candidates > 1 else 0,
+                      int(math.log(tree_counts[0] / self.min_trees, self.eta)) if tree_counts[0] > self.min_trees else 0)
+        return [max(1, round(tree_counts[0] / self.eta ** (n_rungs - rung))) for rung in range(n_rungs)], tree_counts
+
+    def fit(self, X, y):
+        X_all, y_all = X, y
+        X, y = np.asarray(X), np.asarray(y)
+        folds = list(KFold(n_splits=self.cv).split(X))
+        candidates = self.candidates()
+        models = {i: [RandomForestRegressor(random_state=self.random_state, n_jobs=self.n_jobs, warm_start=True, **params) for _ in folds]
+                  for i, params in enumerate(candidates)}
+        rungs, tree_counts = self.rungs(len(candidates))
+
+        alive = list(range(len(candidates)))
+        self.history_ = []
+        for n_trees in rungs:
+            keep = max(1, math.ceil(len(alive) / self.eta))
+            scores = {}
+            for i in alive:
+                scores[i] = self._score(models[i], folds, X, y, n_trees).mean()
+                # Only forests still in the running are kept, so memory is bounded by the survivors
+                ranked = sorted(scores, key=scores.get, reverse=True)
+                for dropped in ranked[keep:]:
+                    models.pop(dropped, None)
+            alive = ranked[:keep]
+            self._record(n_trees, scores, len(alive))
+
+        best_score, best_params, best_target_scores = -np.inf, None, None
+        for n_trees in tree_counts:
+            target_scores = {i: self._score(models[i], folds, X, y, n_trees) for i in alive}
+            scores = {i: target_score.mean() for i, target_score in target_scores.items()}
+            self._record(n_trees, scores, len(alive))
+            for i, score in scores.items():
+                if score > best_score:
+                    best_score, best_params, best_target_scores = score, {**candidates[i], 'n_estimators': n_trees}, target_scores[i]
+
+        self.best_score_ = best_score
+        self.best_params_ = best_params
+        self.best_target_scores_ = best_target_scores
+        models.clear()
+        self.best_estimator_ = RandomForestRegressor(random_state=self.random_state, n_jobs=self.n_jobs, **best_params).fit(X_all, y_all)
+        return self
+
+    def _score(self, fold_models, folds, X, y, n_trees):
+        """ Mean validation R^2 of each target over the folds after growing each fold's forest to n_trees. """
+        scores = []
+        for model, (train, test) in zip(fold_models, folds):
+            model.set_params(n_estimators=n_trees)
+            model.fit(X[train], y[train])
+            scores.append(np.atleast_1d(r2_score(y[test], model.predict(X[test]), multioutput='raw_values')))
+        return np.mean(scores, axis=0)
+
+    def _record(self, n_trees, scores, survivors):
+        self.history_.append({'n_estimators': n_trees, 'candidates': len(scores), 'best_score': max(scores.values())})
+        if self.verbose:
+            print(f"{len(scores)} candidates with {n_trees} trees: best mean R^2 {max(scores.values()):.4f}, {survivors} kept")